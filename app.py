@@ -2,20 +2,26 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import time
 import os
 import re
-import ast
-import difflib
+import orjson
 import subprocess
 import shutil
-import sys
+import select
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tempfile
+import sqlite3
+import threading
+from urllib.parse import urlparse
 import unicodedata
+import functools
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
 
 # 嘗試匯入 SerpAPI，如果沒安裝則提供假物件避免報錯
 try:
@@ -85,6 +91,7 @@ install_and_setup_anystyle()
 # 2. 功能模組：Parser (整合自 parsers.py)
 # ==============================================================================
 
+@st.cache_resource(show_spinner=False)
 def get_anystyle_path():
     # 優先使用系統找到的
     path = shutil.which("anystyle")
@@ -98,17 +105,36 @@ def get_anystyle_path():
 
 ANYSTYLE_CMD = get_anystyle_path()
 
+class _TitleCharTable(dict):
+    # str.translate 對照表：只保留字母、數字與空白 (L/N/Z) 並轉小寫，其餘 (含破折號) 刪除
+    # 字元第一次出現時才計算 Unicode 類別，之後直接查表
+    def __missing__(self, codepoint):
+        ch = chr(codepoint)
+        value = ch.lower() if unicodedata.category(ch)[0] in ("L", "N", "Z") else None
+        self[codepoint] = value
+        return value
+
+_TITLE_CHAR_TABLE = _TitleCharTable()
+
+@functools.lru_cache(maxsize=10000)
+def _clean_title_cached(text):
+    # 正規化 unicode (例如將 full-width 轉 half-width)
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.translate(_TITLE_CHAR_TABLE).split())
+
 def clean_title(text):
     if not text: return ""
-    # 正規化 unicode (例如將 full-width 轉 half-width)
-    text = unicodedata.normalize("NFKC", str(text))
-    # 移除破折號等干擾字元
-    dash_chars = ["-", "–", "—", "−", "‐"]
-    for d in dash_chars:
-        text = text.replace(d, "")
-    # 只保留字母與數字，轉小寫
-    cleaned = [ch.lower() for ch in text if unicodedata.category(ch)[0] in ("L", "N", "Z")]
-    return re.sub(r"\s+", " ", "".join(cleaned)).strip()
+    return _clean_title_cached(str(text))
+
+# 救援解析器 / 語言判定用的 Regex (模組載入時編譯一次)
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+_PAREN_YEAR_RE = re.compile(r'\((\d{4})\)\.?')
+_LEADING_SENTENCE_RE = re.compile(r'^(.+?)(?=\.\s|$)')
+_URL_OR_DOI_RE = re.compile(r'(https?://[^\s]+|10\.\d{4,9}/[-._;()/:a-zA-Z0-9]+)')
+
+def _has_cjk(text):
+    # 預編譯的字元類別搜尋在 C 層逐字掃描，比 Python 迴圈比對 ord() 快
+    return bool(_CJK_RE.search(text))
 
 def basic_python_parser(text):
     """
@@ -119,7 +145,7 @@ def basic_python_parser(text):
     
     try:
         # 1. 抓取年份 (YYYY)
-        year_match = re.search(r'\((\d{4})\)\.?', text)
+        year_match = _PAREN_YEAR_RE.search(text)
         if year_match:
             item["date"] = year_match.group(1)
             # 年份前面通常是作者
@@ -131,19 +157,19 @@ def basic_python_parser(text):
             
             # 嘗試抓取標題 (假設標題以句號結尾)
             # 排除 "In press", "Vol." 等干擾
-            title_match = re.search(r'^(.+?)(?=\.\s|$)', rest_part)
+            title_match = _LEADING_SENTENCE_RE.search(rest_part)
             if title_match:
                 item["title"] = title_match.group(1).strip()
             else:
                 item["title"] = rest_part[:100] # 抓不到就先切前100字
         else:
             # 沒年份，嘗試硬抓標題 (抓第一個句號前的內容)
-            title_match = re.search(r'^(.+?)(?=\.\s|$)', text)
+            title_match = _LEADING_SENTENCE_RE.search(text)
             if title_match:
                 item["title"] = title_match.group(1).strip()
                 
         # 抓網址 (DOI 或 http)
-        url_match = re.search(r'(https?://[^\s]+|10\.\d{4,9}/[-._;()/:a-zA-Z0-9]+)', text)
+        url_match = _URL_OR_DOI_RE.search(text)
         if url_match:
             found_url = url_match.group(1)
             if found_url.startswith("10."):
@@ -161,79 +187,252 @@ def basic_python_parser(text):
         
     return item
 
+def _normalize_anystyle_item(item):
+    # 簡單資料清洗
+    for k, v in list(item.items()):
+        if isinstance(v, list):
+            if k == 'author':
+                authors = []
+                for a in v:
+                    if isinstance(a, dict):
+                        parts = [p for p in [a.get("given"), a.get("family")] if p]
+                        authors.append(" ".join(parts))
+                    else:
+                        authors.append(str(a))
+                item["authors"] = ", ".join(authors)
+            else:
+                item[k] = "; ".join([str(x) for x in v])
+    return item
+
+# AnyStyle 偶爾會在 JSON 前後輸出警告訊息，用來擷取真正的 JSON 陣列
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+def _run_anystyle_batch(lines, use_custom_model):
+    """
+    一次呼叫 AnyStyle 解析多行 (每行一筆文獻)，攤平 Ruby 啟動成本。
+    回傳與 lines 等長、順序一致的結果列表。
+    """
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False, encoding="utf-8") as tmp:
+        tmp.write("\n".join(lines))
+        tmp_path = tmp.name
+
+    try:
+        cmd = [ANYSTYLE_CMD]
+        if use_custom_model:
+            cmd.extend(["-P", "custom.mod"])
+        cmd.extend(["-f", "json", "parse", tmp_path])
+
+        process = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            check=True
+        )
+
+        # 解析輸出
+        output = process.stdout.strip()
+        if not output.startswith("["):
+            match = _JSON_ARRAY_RE.search(output)
+            if match: output = match.group(0)
+
+        data = orjson.loads(output)
+        if len(data) != len(lines):
+            raise ValueError(f"AnyStyle returned {len(data)} items for {len(lines)} lines")
+        return data
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# 常駐的 AnyStyle Ruby 程序：模型只載入一次，之後每行文獻寫入 stdin、從 stdout 讀回一行 JSON
+ANYSTYLE_WORKER_SCRIPT = """
+require 'anystyle'
+require 'json'
+AnyStyle.parser.load_model(ARGV[0]) if ARGV[0]
+STDOUT.sync = true
+STDIN.each_line do |line|
+  begin
+    puts AnyStyle.parser.parse(line.strip, format: 'hash').to_json
+  rescue => e
+    puts({ 'error' => e.message }.to_json)
+  end
+end
+"""
+
+ANYSTYLE_WORKER_TIMEOUT = 30  # 秒；單行超過這個時間沒有回應就視為卡住，改用 CLI 批次模式
+
+def _start_anystyle_worker(model_path):
+    ruby = shutil.which("ruby")
+    if not ruby:
+        return None
+    cmd = [ruby, "-e", ANYSTYLE_WORKER_SCRIPT]
+    if model_path:
+        cmd.append(model_path)
+    try:
+        # 不經過 Python 緩衝 (bufsize=0)，讀取時才能用 select 設定期限
+        return subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+    except OSError:
+        return None
+
+def _stop_anystyle_worker(worker):
+    proc = worker["proc"]
+    worker["proc"] = None
+    if proc is None:
+        return
+    proc.kill()
+    try:
+        proc.wait(timeout=5)  # 回收程序，避免留下 zombie
+    except subprocess.TimeoutExpired:
+        pass
+
+@st.cache_resource(show_spinner=False)
+def get_anystyle_worker(model_path=None):
+    # 每個模型一組常駐程序狀態；程序在第一次使用時啟動，掛掉時只重啟這一個模型的程序
+    # 同一個程序可能被多個 session 共用，一次只允許一批請求
+    return {"model_path": model_path, "proc": None, "lock": threading.Lock()}
+
+def _read_worker_line(proc, timeout):
+    # 在期限內讀回一行輸出；逾時丟出 TimeoutError，程序結束丟出 EOFError
+    fd = proc.stdout.fileno()
+    deadline = time.monotonic() + timeout
+    chunks = []
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            raise TimeoutError(f"AnyStyle worker did not respond within {timeout}s")
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            raise EOFError("AnyStyle worker exited")
+        chunks.append(chunk)
+        if b"\n" in chunk:
+            output = b"".join(chunks)
+            if not output.endswith(b"\n"):
+                raise ValueError(f"Unexpected AnyStyle worker output: {output[:100]!r}")
+            return output
+
+def _run_anystyle_worker(lines, use_custom_model):
+    """
+    透過常駐程序解析；程序無法使用時回傳 None，由呼叫端改用 CLI 批次模式。
+    單行解析失敗 (worker 回傳 {"error": ...}) 只會讓該行的結果為 None，不影響其他行。
+    """
+    worker = get_anystyle_worker("custom.mod" if use_custom_model else None)
+
+    with worker["lock"]:
+        if worker["proc"] is None or worker["proc"].poll() is not None:
+            worker["proc"] = _start_anystyle_worker(worker["model_path"])
+        proc = worker["proc"]
+        if proc is None:
+            return None
+        try:
+            data = []
+            for line in lines:
+                # 逐行送出再讀回，避免兩邊的 pipe 緩衝區同時塞滿
+                proc.stdin.write((line + "\n").encode("utf-8"))
+                output = _read_worker_line(proc, ANYSTYLE_WORKER_TIMEOUT)
+                parsed = orjson.loads(output)
+                if isinstance(parsed, dict) and "error" in parsed:
+                    print(f"⚠️ AnyStyle failed to parse line: {parsed['error']}")
+                    data.append(None)
+                    continue
+                if not isinstance(parsed, list) or len(parsed) != 1:
+                    raise ValueError(f"Unexpected AnyStyle worker output: {output[:100]!r}")
+                data.append(parsed[0])
+            return data
+        except (OSError, ValueError, EOFError, TimeoutError) as e:
+            print(f"⚠️ AnyStyle worker unavailable, using CLI batch mode. Error: {e}")
+            _stop_anystyle_worker(worker)
+            return None
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _parse_anystyle_lines(lines, use_custom_model, model_mtime=None):
+    """
+    同一批文獻重新驗證時直接沿用上次的 AnyStyle 解析結果 (lines 需為 tuple)。
+    model_mtime 只用來當快取鍵，custom.mod 更新後會重新解析。
+    個別解析失敗的行在結果中為 None；整批都失敗時丟出例外，不會被快取。
+    """
+    data = _run_anystyle_worker(list(lines), use_custom_model)
+    if data is None:
+        try:
+            data = _run_anystyle_batch(list(lines), use_custom_model)
+        except OSError:
+            raise  # 找不到 AnyStyle 等環境問題，逐行重試也不會成功
+        except Exception as e:
+            # 批次中只要有一行出錯整批就會失敗，改成逐行重試，只有真正失敗的行才交給救援解析器
+            print(f"⚠️ AnyStyle batch failed, retrying {len(lines)} lines one by one. Error: {e}")
+            data = []
+            for line in lines:
+                try:
+                    data.append(_run_anystyle_batch([line], use_custom_model)[0])
+                except Exception as line_error:
+                    print(f"⚠️ AnyStyle failed to parse line: {line_error}")
+                    data.append(None)
+    if all(item is None for item in data):
+        raise RuntimeError("AnyStyle failed to parse every line")
+    return data
+
 def parse_references_with_anystyle(raw_text):
     if not raw_text or not raw_text.strip():
         return [], []
 
     lines = [line.strip() for line in raw_text.split('\n') if line.strip()]
-    structured_refs = []
+    structured_refs = [None] * len(lines)
     
     use_custom_model = os.path.exists("custom.mod")
     progress_bar = st.progress(0)
-    
+
+    # 依語言分成兩批 (中文使用 custom.mod)，各自交給對應模型的 AnyStyle 程序
+    batches = {False: [], True: []}
     for i, line in enumerate(lines):
+        has_chinese = _has_cjk(line)
+        batches[has_chinese and use_custom_model].append(i)
+
+    done = 0
+    for use_model, indices in batches.items():
+        if not indices:
+            continue
+        batch_lines = [lines[i] for i in indices]
+
         # -------------------------------------------------
         # 策略 A: 優先嘗試 AnyStyle (Ruby)
         # -------------------------------------------------
         try:
-            has_chinese = bool(re.search(r'[\u4e00-\u9fff]', line))
-            cmd = [ANYSTYLE_CMD]
-            if has_chinese and use_custom_model:
-                cmd.extend(["-P", "custom.mod"])
-            cmd.extend(["-f", "json", "parse"])
-            
-            # 執行指令
-            process = subprocess.run(
-                cmd,
-                input=line,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                check=True
-            )
-            
-            # 解析輸出
-            output = process.stdout.strip()
-            if not output.startswith("["):
-                 match = re.search(r"\[.*\]", output, re.DOTALL)
-                 if match: output = match.group(0)
-            
-            data = ast.literal_eval(output)
-            
-            for item in data:
-                # 簡單資料清洗
-                for k, v in item.items():
-                    if isinstance(v, list):
-                        if k == 'author':
-                            authors = []
-                            for a in v:
-                                if isinstance(a, dict):
-                                    parts = [p for p in [a.get("given"), a.get("family")] if p]
-                                    authors.append(" ".join(parts))
-                                else:
-                                    authors.append(str(a))
-                            item["authors"] = ", ".join(authors)
-                        else:
-                            item[k] = "; ".join([str(x) for x in v])
-
-                item["text"] = line
+            model_mtime = os.path.getmtime("custom.mod") if use_model else None
+            data = _parse_anystyle_lines(tuple(batch_lines), use_model, model_mtime)
+            for i, item in zip(indices, data):
+                if item is None:
+                    # 只有這一行解析失敗，單獨改用 Python 解析
+                    item = basic_python_parser(lines[i])
+                    item["note"] = "Parsed via Python (Fallback)"
+                    structured_refs[i] = item
+                    continue
+                item = _normalize_anystyle_item(item)
+                item["text"] = lines[i]
                 if "title" not in item: item["title"] = "N/A"
-                structured_refs.append(item)
+                structured_refs[i] = item
 
         # -------------------------------------------------
         # 策略 B: 救援模式 (Python Fallback)
         # -------------------------------------------------
         except Exception as e:
             # 這裡不顯示錯誤，而是直接切換到 Python 解析
-            print(f"⚠️ AnyStyle failed for line {i}, switching to Python parser. Error: {e}")
+            print(f"⚠️ AnyStyle failed for {len(indices)} lines, switching to Python parser. Error: {e}")
             
-            fallback_item = basic_python_parser(line)
-            # 在物件中標記它是用救援模式抓的 (可選)
-            fallback_item["note"] = "Parsed via Python (Fallback)"
-            
-            structured_refs.append(fallback_item)
+            for i in indices:
+                fallback_item = basic_python_parser(lines[i])
+                # 在物件中標記它是用救援模式抓的 (可選)
+                fallback_item["note"] = "Parsed via Python (Fallback)"
+                structured_refs[i] = fallback_item
 
-        progress_bar.progress((i + 1) / len(lines))
+        done += len(indices)
+        progress_bar.progress(done / len(lines))
 
     return lines, structured_refs
 
@@ -254,32 +453,168 @@ def load_csv_data(uploaded_file):
             st.error(f"讀取 CSV 失敗: {e}")
             return None
 
-def search_local_database(df, title_column, query_title, threshold=0.8):
+@st.cache_data(show_spinner=False)
+def load_local_database(path, mtime=None):
+    """
+    讀取預設 CSV 並預先清洗標題欄位；Streamlit 每次 rerun 都會重跑整個腳本，
+    快取後只有第一次需要解析 CSV。mtime 只用來當快取鍵，檔案更新後會重新載入。
+    """
+    df = load_csv_data(path)
+    if df is None:
+        return None, None
+    target_col = "論文名稱" if "論文名稱" in df.columns else df.columns[0]
+    add_clean_title_column(df, target_col)
+    return df, target_col
+
+@st.cache_resource(show_spinner=False)
+def load_title_index(path, mtime=None):
+    # 標題子字串索引只需建立一次 (cache_resource 不會複製，整個 process 共用)
+    df, target_col = load_local_database(path, mtime)
+    if df is None:
+        return None
+    return build_title_index(_clean_title_choices(df, target_col))
+
+def clean_title_column_name(title_column):
+    return f"_clean_{title_column}"
+
+def add_clean_title_column(df, title_column):
+    # 載入後預先清洗一次標題欄位 (連同長度)，搜尋時直接讀取
+    if df is not None and title_column in df.columns:
+        clean_column = clean_title_column_name(title_column)
+        df[clean_column] = df[title_column].astype(str).map(clean_title)
+        df[f"{clean_column}_len"] = df[clean_column].str.len()
+    return df
+
+def _clean_title_choices(df, title_column):
+    clean_column = clean_title_column_name(title_column)
+    if clean_column in df.columns:
+        return df[clean_column].tolist()
+    return [clean_title(t) for t in df[title_column].astype(str)]
+
+def _clean_title_lengths(df, title_column, choices):
+    length_column = f"{clean_title_column_name(title_column)}_len"
+    if length_column in df.columns:
+        return df[length_column].to_numpy()
+    return np.fromiter(map(len, choices), dtype=np.int64, count=len(choices))
+
+def _length_window(clean_query, threshold):
+    # fuzz.ratio 的上限是 2*min(len)/(len總和)，超出這個長度區間的標題不可能達到門檻
+    q_len = len(clean_query)
+    min_len = q_len * threshold / (2 - threshold)
+    max_len = q_len * (2 - threshold) / threshold if threshold > 0 else float("inf")
+    return min_len, max_len
+
+def build_title_index(choices):
+    # 以 SQLite FTS5 trigram 建立清洗後標題的子字串索引 (in-memory)，
+    # SQLite 不支援 trigram 時回傳 None，搜尋會退回逐列比對
+    try:
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.execute("CREATE VIRTUAL TABLE titles USING fts5(clean, tokenize='trigram')")
+        conn.executemany("INSERT INTO titles(rowid, clean) VALUES (?, ?)", enumerate(choices))
+        # 完全相同的清洗後標題直接以主鍵查表 (同名標題保留第一列)
+        conn.execute("CREATE TABLE exact_titles(clean TEXT PRIMARY KEY, row INTEGER) WITHOUT ROWID")
+        conn.executemany(
+            "INSERT OR IGNORE INTO exact_titles(clean, row) VALUES (?, ?)",
+            ((clean, i) for i, clean in enumerate(choices) if clean)
+        )
+        conn.commit()
+        return conn
+    except sqlite3.Error:
+        return None
+
+def _find_contained_title(clean_query, choices, lengths=None, title_index=None):
+    # 快速過濾：標題互相包含就直接視為命中 (回傳第一個命中的列)
+    if title_index is None or lengths is None or len(clean_query) < 3:
+        for i, clean_db_title in enumerate(choices):
+            if clean_db_title and (clean_query in clean_db_title or clean_db_title in clean_query):
+                return i
+        return None
+
+    # 0. 標題完全相同：主鍵查詢，不必做子字串或模糊比對
+    row = title_index.execute("SELECT row FROM exact_titles WHERE clean = ?", (clean_query,)).fetchone()
+    if row:
+        return row[0]
+
+    # 1. 資料庫標題包含查詢字串：交給 trigram 索引
+    row = title_index.execute(
+        "SELECT rowid FROM titles WHERE clean LIKE ? ORDER BY rowid LIMIT 1",
+        (f"%{clean_query}%",)
+    ).fetchone()
+    first = row[0] if row else None
+
+    # 2. 查詢字串包含資料庫標題：只可能是不比查詢長的標題
+    for i in np.flatnonzero((lengths > 0) & (lengths <= len(clean_query))):
+        if first is not None and i >= first:
+            break
+        if choices[i] in clean_query:
+            return int(i)
+    return first
+
+def search_local_database(df, title_column, query_title, threshold=0.8, title_index=None):
     if df is None or not title_column or not query_title:
         return None, None
 
     clean_query = clean_title(query_title)
-    best_score = 0
-    best_match_row = None
+    choices = _clean_title_choices(df, title_column)
+
+    lengths = _clean_title_lengths(df, title_column, choices)
+    hit = _find_contained_title(clean_query, choices, lengths, title_index)
+    if hit is not None:
+        return df.iloc[hit], 1.0
+
+    # 長度篩選 (向量化)：長度差太多的標題不送進比對
+    min_len, max_len = _length_window(clean_query, threshold)
+    in_window = np.flatnonzero((lengths >= min_len) & (lengths <= max_len))
+    candidates = {int(i): choices[i] for i in in_window}
+
+    best = process.extractOne(clean_query, candidates, scorer=fuzz.ratio, score_cutoff=threshold * 100)
+    if best is not None:
+        _, score, index = best
+        return df.iloc[index], score / 100
+    return None, 0
 
-    # 簡單遍歷搜尋
-    for index, row in df.iterrows():
-        db_title = str(row[title_column])
-        clean_db_title = clean_title(db_title)
-        
-        # 快速過濾
-        if clean_query in clean_db_title or clean_db_title in clean_query:
-            score = 1.0
+def search_local_database_batch(df, title_column, query_titles, threshold=0.8, title_index=None):
+    """
+    一次比對多個標題：所有查詢用一次 process.cdist (多核心 C++) 算出分數矩陣，
+    回傳與 query_titles 等長的 [(row, score), ...]。
+    """
+    if df is None or not title_column:
+        return [(None, None)] * len(query_titles)
+
+    choices = _clean_title_choices(df, title_column)
+    lengths = _clean_title_lengths(df, title_column, choices)
+    results = [(None, None) if not q else (None, 0) for q in query_titles]
+
+    pending, pending_queries = [], []
+    for qi, query_title in enumerate(query_titles):
+        if not query_title:
+            continue
+        clean_query = clean_title(query_title)
+        hit = _find_contained_title(clean_query, choices, lengths, title_index)
+        if hit is not None:
+            results[qi] = (df.iloc[hit], 1.0)
         else:
-            score = SequenceMatcher(None, clean_query, clean_db_title).ratio()
-        
-        if score > best_score:
-            best_score = score
-            best_match_row = row
+            pending.append(qi)
+            pending_queries.append(clean_query)
+
+    if pending:
+        # 只比對落在任一查詢長度區間內的標題
+        windows = [_length_window(q, threshold) for q in pending_queries]
+        min_len = min(w[0] for w in windows)
+        max_len = max(w[1] for w in windows)
+        in_window = np.flatnonzero((lengths >= min_len) & (lengths <= max_len))
+
+        if len(in_window):
+            scores = process.cdist(
+                pending_queries, [choices[i] for i in in_window],
+                scorer=fuzz.ratio, score_cutoff=threshold * 100, workers=-1
+            )
+            for qi, row_scores in zip(pending, scores):
+                best = int(row_scores.argmax())
+                if row_scores[best] > 0 and row_scores[best] >= threshold * 100:
+                    results[qi] = (df.iloc[in_window[best]], row_scores[best] / 100)
 
-    if best_score >= threshold:
-        return best_match_row, best_score
-    return None, 0
+    return results
 
 # ==============================================================================
 # 4. 功能模組：API Clients (整合自 api_clients.py)
@@ -287,8 +622,89 @@ def search_local_database(df, title_column, query_title, threshold=0.8):
 
 S2_API_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
 OPENALEX_API_URL = "https://api.openalex.org/works"
-MAX_RETRIES = 2
 TIMEOUT = 10
+CONFIDENT_MATCH_THRESHOLD = 0.9  # 命中結果的信心度低於此值 (或作者對不上) 時，報告標示為「不確定」
+HOST_CONCURRENCY = 5  # 同一主機同時最多幾個請求 (與外層 max_workers 一致，避免階段並行後打爆 API)
+
+# 共用連線池：同一主機的請求重用 TCP/TLS 連線，重試交給 urllib3 (含指數退避與 Retry-After)
+HTTP_SESSION = requests.Session()
+_RETRY_OPTIONS = dict(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET", "HEAD"],
+    raise_on_status=False
+)
+try:
+    # 退避時間加上隨機抖動，避免多個執行緒同時重試 (backoff_jitter 需要 urllib3 2.x)
+    _retry = Retry(**_RETRY_OPTIONS, backoff_jitter=0.3)
+except TypeError:
+    _retry = Retry(**_RETRY_OPTIONS)
+_http_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=_retry
+)
+HTTP_SESSION.mount("https://", _http_adapter)
+HTTP_SESSION.mount("http://", _http_adapter)
+# 預設標頭只設定一次，各請求傳入的 headers 會與之合併 (例如 Scopus 的 API Key)
+HTTP_SESSION.headers.update({'User-Agent': 'ReferenceChecker/1.0'})
+
+# 網址存活探測另用一個不重試的 Session：目標是任意網站，逾時或 503 (含 Retry-After) 本身就是要回報的結果，
+# 交給 urllib3 重試只會讓每個失效網址卡住工作執行緒數十秒
+PROBE_SESSION = requests.Session()
+_probe_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0)
+PROBE_SESSION.mount("https://", _probe_adapter)
+PROBE_SESSION.mount("http://", _probe_adapter)
+# 網址探測使用 verify=False，載入時關閉一次警告即可 (不必每次請求都修改全域 warning filter)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+@st.cache_resource(show_spinner=False)
+def get_host_limits():
+    # 每主機的並行上限與限速狀態必須整個 process 共用：Streamlit 每次 rerun 都會重新執行腳本，
+    # 放在模組層級的話每次 rerun (以及每個 session) 都會拿到一組新的，限制就形同虛設
+    return {
+        "semaphores": {},  # host -> BoundedSemaphore
+        "buckets": {},  # host -> (剩餘 token, 上次補充時間)
+        "lock": threading.Lock(),
+    }
+
+def _host_slot(url):
+    host = urlparse(url).netloc
+    limits = get_host_limits()
+    with limits["lock"]:
+        semaphores = limits["semaphores"]
+        if host not in semaphores:
+            semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return semaphores[host]
+
+# 各 API 主機每秒可發出的請求數 (token bucket)，未列出的主機不限速
+HOST_RATE_LIMITS = {
+    "api.crossref.org": 10,
+    "api.elsevier.com": 5,
+    "api.semanticscholar.org": 1,
+    "api.openalex.org": 10,
+    "serpapi.com": 2,
+}
+
+def _wait_for_rate_limit(url):
+    host = urlparse(url).netloc or url
+    rate = HOST_RATE_LIMITS.get(host)
+    if not rate:
+        return
+    limits = get_host_limits()
+    buckets = limits["buckets"]
+    while True:
+        with limits["lock"]:
+            now = time.monotonic()
+            tokens, last = buckets.get(host, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens >= 1:
+                buckets[host] = (tokens - 1, now)
+                return
+            buckets[host] = (tokens, now)
+            wait = (1 - tokens) / rate
+        time.sleep(wait)
 
 def _read_key_file(filename):
     try:
@@ -301,13 +717,12 @@ def get_scopus_key():
 def get_serpapi_key():
     return st.secrets.get("serpapi_key") or _read_key_file("serpapi_key.txt")
 
-def _check_author_match(query_author, result_authors_list):
-    """
-    作者比對邏輯 (Zhang, X. vs L. Zhang)
-    """
-    if not query_author or len(query_author) < 2: return True 
-    
-    query_author = query_author.lower().strip()
+# 常見姓氏：撞名機率高，必須再比對名字首字母
+_COMMON_SURNAMES = frozenset({'wang', 'chen', 'lee', 'li', 'zhang', 'liu', 'lin', 'yang', 'huang', 'wu', 'smith', 'jones'})
+
+@functools.lru_cache(maxsize=4096)
+def _parse_query_author(query_author):
+    # 同一筆文獻的第一作者會跟每個候選結果的每位作者比對，拆解結果快取起來
     q_family = ""
     q_given_initial = ""
 
@@ -322,8 +737,24 @@ def _check_author_match(query_author, result_authors_list):
         if len(parts) > 1:
             q_given_initial = parts[0].strip()[0]
 
-    common_names = ['wang', 'chen', 'lee', 'li', 'zhang', 'liu', 'lin', 'yang', 'huang', 'wu', 'smith', 'jones']
-    is_common_name = (q_family in common_names)
+    return q_family, q_given_initial, q_family in _COMMON_SURNAMES
+
+@functools.lru_cache(maxsize=4096)
+def _parse_result_author(author):
+    # 字串格式的結果作者 (例如 "L. Zhang") 拆成 (姓, 名字首字母, 全名)，重複出現的作者直接取快取
+    r_full = author.lower()
+    if " " in r_full:
+        parts = r_full.split()
+        return parts[-1], parts[0][0], r_full
+    return r_full, "", r_full
+
+def _check_author_match(query_author, result_authors_list):
+    """
+    作者比對邏輯 (Zhang, X. vs L. Zhang)
+    """
+    if not query_author or len(query_author) < 2: return True 
+    
+    q_family, q_given_initial, is_common_name = _parse_query_author(query_author.lower().strip())
 
     for auth in result_authors_list:
         r_family = ""
@@ -336,12 +767,7 @@ def _check_author_match(query_author, result_authors_list):
             if given: r_given_initial = given[0]
             r_full = f"{given} {r_family}".strip()
         else:
-            r_full = str(auth).lower()
-            if " " in r_full:
-                r_family = r_full.split()[-1]
-                r_given_initial = r_full.split()[0][0]
-            else:
-                r_family = r_full
+            r_family, r_given_initial, r_full = _parse_result_author(str(auth))
 
         if q_family == r_family or q_family in r_full:
             if is_common_name and q_given_initial and r_given_initial:
@@ -350,65 +776,112 @@ def _check_author_match(query_author, result_authors_list):
             return True
     return False
 
+# 4 位數年份與 arXiv、Available、Online 等字眼合併成一個 Regex，一次掃描全部移除
+_NOISE_RE = re.compile(r'\b(?:(?:19|20)\d{2}|arxiv|biorxiv|available|online|access)\b', re.IGNORECASE)
+_STOP_WORDS = frozenset({'a', 'an', 'the', 'of', 'in', 'for', 'with', 'on', 'at', 'by', 'and', 'from', 'to'})
+_ET_AL_RE = re.compile(r'(?i)[\(\[]?\bet\.?\s*al\.?[\)\]]?')
+
+def _remove_noise(text):
+    text = _NOISE_RE.sub('', text)
+    return " ".join(text.split())
+
 def _is_match(query, result):
     if not query or not result: return False
-    c_q = clean_title(query)
-    c_r = clean_title(result)
-    
-    def remove_noise(text):
-        text = re.sub(r'\b(19|20)\d{2}\b', '', text)
-        text = re.sub(r'\b(arxiv|biorxiv|available|online|access)\b', '', text, flags=re.IGNORECASE)
-        return " ".join(text.split())
-
-    c_q = remove_noise(c_q)
-    c_r = remove_noise(c_r)
+    return _is_match_cleaned(_remove_noise(clean_title(query)), _remove_noise(clean_title(result)))
 
+@functools.lru_cache(maxsize=8192)
+def _is_match_cleaned(c_q, c_r):
+    # 同一組 (查詢, 結果) 標題在各階段可能被重複比對，結果只取決於清洗後字串
     if len(c_q) > len(c_r) * 1.5:
         if c_r in c_q: return True
 
-    ratio = SequenceMatcher(None, c_q, c_r).ratio()
-    if ratio >= 0.65: return True
+    # score_cutoff 讓 RapidFuzz 依長度上限提早放棄，低於門檻時回傳 0
+    # fuzz.ratio (Indel) 一定不低於 SequenceMatcher 的分數，沿用 0.65 會放過更多假標題；
+    # 門檻提高到 0.70，讓通過率接近原本 SequenceMatcher >= 0.65 的水準
+    ratio = fuzz.ratio(c_q, c_r, score_cutoff=70) / 100
+    if ratio >= 0.70: return True
     
     q_words = set(c_q.split())
     r_words = set(c_r.split())
-    stop_words = {'a', 'an', 'the', 'of', 'in', 'for', 'with', 'on', 'at', 'by', 'and', 'from', 'to'}
-    missing = [w for w in q_words if w not in stop_words and w not in r_words]
+    # 集合差集在 C 層完成，不必逐字在 Python 迴圈中判斷
+    missing = q_words - r_words - _STOP_WORDS
     
     if len(missing) <= 1 and len(q_words) >= 5: return True
     if len(missing) == 0 and len(c_q) > len(c_r) * 0.3: return True
 
     return False
 
+def _title_confidence(query, result):
+    # 信心度：清洗後標題的相似度 (0~1)，_is_match 通過但分數偏低的結果視為「不確定」
+    if not query or not result: return None
+    return round(fuzz.ratio(_remove_noise(clean_title(query)), _remove_noise(clean_title(result))) / 100, 2)
+
 def _call_external_api_with_retry(url, params, headers=None):
-    if not headers: headers = {'User-Agent': 'ReferenceChecker/1.0'}
-    for _ in range(MAX_RETRIES):
-        try:
-            response = requests.get(url, params=params, headers=headers, timeout=TIMEOUT)
-            if response.status_code == 200: return response.json(), "OK"
-            if response.status_code in [401, 403]: return None, f"Auth Error ({response.status_code})"
-        except: pass
+    try:
+        _wait_for_rate_limit(url)
+        with _host_slot(url):
+            response = HTTP_SESSION.get(url, params=params, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 200: return response.json(), "OK"
+        if response.status_code in [401, 403]: return None, f"Auth Error ({response.status_code})"
+    except: pass
     return None, "Error"
 
 # --- 各個 API 實作 ---
 
-def search_crossref_by_doi(doi, target_title=None):
-    if not doi: return None, None, "Empty DOI"
-    clean_doi = doi.strip(' ,.;)]}>')
+CROSSREF_DOI_BATCH_SIZE = 20
+
+def _clean_doi(doi):
+    return doi.strip(' ,.;)]}>')
+
+def _evaluate_crossref_doi_item(item, clean_doi, target_title=None, author=None):
+    titles = item.get("title", [])
+    res_title = titles[0] if titles else ""
+    if target_title and not _is_match(target_title, res_title):
+        return None, None, f"DOI Title Mismatch", None
+    confidence = _title_confidence(target_title, res_title)
+    # 作者對不上時信心度壓在門檻以下，報告中標示為不確定
+    if confidence and author and not _check_author_match(author, item.get("author", [])):
+        confidence = min(confidence, CONFIDENT_MATCH_THRESHOLD - 0.01)
+    return res_title, item.get("URL") or f"https://doi.org/{clean_doi}", "OK", confidence
+
+def fetch_crossref_items_by_dois(dois):
+    """
+    以 /works?filter=doi:A,doi:B,... 一次取回多筆 DOI 的 metadata (每批 CROSSREF_DOI_BATCH_SIZE 筆)，
+    回傳 {小寫 DOI: item}。查不到或請求失敗的 DOI 不會出現在結果中，之後仍走單筆查詢。
+    """
+    # DOI 本身含逗號時無法放進 filter 語法
+    pending = sorted({_clean_doi(d).lower() for d in dois if d and "," not in d})
+    items = {}
+    for start in range(0, len(pending), CROSSREF_DOI_BATCH_SIZE):
+        batch = pending[start:start + CROSSREF_DOI_BATCH_SIZE]
+        params = {"filter": ",".join(f"doi:{d}" for d in batch), "rows": len(batch)}
+        data, status = _call_external_api_with_retry("https://api.crossref.org/works", params)
+        if status != "OK" or not data:
+            continue
+        for item in data.get("message", {}).get("items", []):
+            if item.get("DOI"):
+                items[item["DOI"].lower()] = item
+    return items
+
+def search_crossref_by_doi(doi, target_title=None, author=None, item=None):
+    # item：fetch_crossref_items_by_dois 預先批次取回的結果，有的話就不必再發請求
+    if not doi: return None, None, "Empty DOI", None
+    clean_doi = _clean_doi(doi)
+    if item is not None:
+        return _evaluate_crossref_doi_item(item, clean_doi, target_title, author)
     url = f"https://api.crossref.org/works/{clean_doi}"
     try:
-        response = requests.get(url, timeout=5)
+        _wait_for_rate_limit(url)
+        with _host_slot(url):
+            response = HTTP_SESSION.get(url, timeout=5)
         if response.status_code == 200:
             item = response.json().get("message", {})
-            titles = item.get("title", [])
-            res_title = titles[0] if titles else ""
-            if target_title and not _is_match(target_title, res_title):
-                return None, None, f"DOI Title Mismatch"
-            return res_title, item.get("URL") or f"https://doi.org/{clean_doi}", "OK"
-        return None, None, f"HTTP {response.status_code}"
-    except: return None, None, "Conn Error"
+            return _evaluate_crossref_doi_item(item, clean_doi, target_title, author)
+        return None, None, f"HTTP {response.status_code}", None
+    except: return None, None, "Conn Error", None
 
 def search_crossref_by_text(title, author=None):
-    if not title: return None, "Empty Title"
+    if not title: return None, "Empty Title", None
     params = {'query.bibliographic': title, 'rows': 2}
     if author: params['query.author'] = author
     data, status = _call_external_api_with_retry("https://api.crossref.org/works", params)
@@ -419,29 +892,43 @@ def search_crossref_by_text(title, author=None):
             res_authors = item.get('author', [])
             if _is_match(title, res_title):
                 if _check_author_match(author, res_authors):
-                    return item.get('URL') or f"https://doi.org/{item.get('DOI')}", "OK"
+                    return item.get('URL') or f"https://doi.org/{item.get('DOI')}", "OK", _title_confidence(title, res_title)
                 else: continue
-        return None, "Match failed"
-    return None, status
+        return None, "Match failed", None
+    return None, status, None
 
 def search_scopus_by_title(title, api_key, author=None):
-    if not api_key: return None, "No API Key"
+    if not api_key: return None, "No API Key", None
     url = "https://api.elsevier.com/content/search/scopus"
     headers = {"Accept": "application/json", "X-ELS-APIKey": api_key}
     params = {"query": f'TITLE("{title}")', "count": 1}
     data, status = _call_external_api_with_retry(url, params, headers)
     if status == "OK" and data:
         entries = data.get('search-results', {}).get('entry', [])
-        if not entries or 'error' in entries[0]: return None, "(No results)"
+        if not entries or 'error' in entries[0]: return None, "(No results)", None
         match = entries[0]
         res_title = match.get('dc:title', '')
         res_creator = match.get('dc:creator', '')
         if _is_match(title, res_title):
             if _check_author_match(author, [res_creator]):
-                return match.get('prism:url', 'https://www.scopus.com'), "OK"
-            else: return None, "Author Mismatch"
-        else: return None, "Title Mismatch"
-    return None, "Error"
+                return match.get('prism:url', 'https://www.scopus.com'), "OK", _title_confidence(title, res_title)
+            else: return None, "Author Mismatch", None
+        else: return None, "Title Mismatch", None
+    return None, "Error", None
+
+def _serpapi_error(results):
+    """
+    回傳 SerpAPI 回應中的暫時性錯誤 (額度用盡、金鑰錯誤等)，沒有錯誤時回傳 None。
+    查無結果時 SerpAPI 也會帶 "error" 欄位，那是正常的查無結果，不算錯誤 (仍可寫入快取)。
+    """
+    error = results.get("error")
+    if not error:
+        return None
+    if results.get("search_information", {}).get("organic_results_state") == "Fully empty":
+        return None
+    if "hasn't returned any results" in error:
+        return None
+    return error
 
 def search_scholar_by_title(title, api_key, author=None, raw_text=None):
     if not api_key or not GoogleSearch: return None, "No API Key or SerpLib"
@@ -449,7 +936,11 @@ def search_scholar_by_title(title, api_key, author=None, raw_text=None):
     def _do_search(query_string, match_mode, required_author=None):
         try:
             params = {"engine": "google_scholar", "q": query_string, "api_key": api_key, "num": 10}
+            _wait_for_rate_limit("serpapi.com")
             results = GoogleSearch(params).get_dict()
+            # 額度用盡、金鑰錯誤等情況 SerpAPI 會回傳 {"error": ...}，不能當成「查無結果」 (見 _serpapi_error)
+            error = _serpapi_error(results)
+            if error: return None, f"Error: {error}"
             organic = results.get("organic_results", [])
             for res in organic:
                 res_title = res.get("title", "")
@@ -468,44 +959,84 @@ def search_scholar_by_title(title, api_key, author=None, raw_text=None):
 
     valid_author = None
     if author:
-        cleaned = re.sub(r'(?i)[\(\[]?\bet\.?\s*al\.?[\)\]]?', '', author).strip().strip(' .,;()[]')
+        cleaned = _ET_AL_RE.sub('', author).strip().strip(' .,;()[]')
         if len(cleaned) > 1: valid_author = cleaned
 
+    # 任一策略出錯時回傳 Error 狀態 (不寫入快取)，避免一次額度用盡就把查無結果快取 30 天
+    error = None
+
     if valid_author:
         link, status = _do_search(f'{title} {valid_author}', "match (Title+Author)")
         if link: return link, status
+        if status: error = status
 
     link, status = _do_search(title, "match (Title Only)", required_author=valid_author)
     if link: return link, status
+    if status: error = status
     
     if raw_text and len(raw_text) > 10:
         link, status = _do_search(raw_text, "match (Raw Text Fallback)", required_author=valid_author)
         if link: return link, status
+        if status: error = status
 
-    return None, "No match found"
+    return None, error or "No match found"
 
 def search_scholar_by_ref_text(ref_text, api_key, target_title=None):
     if not api_key or not GoogleSearch: return None, "No API Key"
     params = {"engine": "google_scholar", "q": ref_text, "api_key": api_key, "num": 1}
     try:
+        _wait_for_rate_limit("serpapi.com")
         results = GoogleSearch(params).get_dict()
+        error = _serpapi_error(results)
+        if error: return None, f"Error: {error}"
         organic = results.get("organic_results", [])
         if organic:
             res_title = organic[0].get("title", "")
             if target_title and not _is_match(target_title, res_title):
                 return None, "Title mismatch"
             return organic[0].get("link"), "similar"
-    except: pass
+    except Exception as e: return None, f"Error: {e}"
     return None, "No results"
 
-def check_url_availability(url):
+URL_CHECK_TTL = 3600
+URL_CHECK_CACHE_SIZE = 512
+
+@st.cache_resource(show_spinner=False)
+def get_url_check_cache():
+    # Streamlit 每次 rerun 都會重新執行整個腳本，模組層級的 dict 會被清空；
+    # 放在 cache_resource 裡才能跨 rerun、跨 session 共用
+    return {"entries": {}, "lock": threading.Lock()}  # entries: url -> 檢查時間 (只記錄可連線的網址)
+
+def check_url_availability(url, force_refresh=False):
     if not url or not url.startswith("http"): return False
     
     # 過濾明顯非論文頁面的短網址 (例如純首頁)
     if url.count('/') < 3: return False
-    
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    
+
+    # 可連線的網址一小時內不重複探測 (重複引用、重新驗證時常見)；
+    # 失敗可能只是暫時逾時，不快取，下次驗證會重新探測
+    cache = get_url_check_cache()
+    entries = cache["entries"]
+    now = time.time()
+    if not force_refresh:
+        with cache["lock"]:
+            checked_at = entries.get(url)
+        if checked_at and now - checked_at < URL_CHECK_TTL:
+            return True
+
+    with _host_slot(url):
+        ok = _probe_url(url)
+
+    with cache["lock"]:
+        entries.pop(url, None)
+        if ok:
+            entries[url] = now
+            # 超過上限時丟掉最早寫入的項目
+            while len(entries) > URL_CHECK_CACHE_SIZE:
+                entries.pop(next(iter(entries)))
+    return ok
+
+def _probe_url(url):
     # 偽裝成一般瀏覽器的 User-Agent
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
@@ -513,7 +1044,7 @@ def check_url_availability(url):
     
     try:
         # 1. 先嘗試 HEAD 請求 (較快)
-        resp = requests.head(
+        resp = PROBE_SESSION.head(
             url, 
             headers=headers, 
             timeout=5, 
@@ -525,22 +1056,99 @@ def check_url_availability(url):
             
         # 2. 如果 HEAD 失敗 (例如 403/404/405)，嘗試 GET 請求 (較慢但準確)
         # 很多學術網站不支援 HEAD
-        resp = requests.get(
+        with PROBE_SESSION.get(
             url, 
             headers=headers, 
             timeout=8, # GET 比較慢，給多一點時間
             allow_redirects=True, 
             verify=False,
             stream=True # 只下載標頭和一點點內容，不用下載整頁
-        )
-        if 200 <= resp.status_code < 400:
-            return True
+        ) as resp:
+            # 用 with 關閉串流，連線才會還回連線池
+            if 200 <= resp.status_code < 400:
+                return True
             
     except Exception:
         pass
         
     return False
 
+# --- 查詢結果快取 (SQLite，跨 Session 保留) ---
+
+CACHE_DB_PATH = "cache.sqlite"
+NEGATIVE_CACHE_TTL = 30 * 24 * 3600  # 查無結果只保留 30 天，找到的結果永久保留
+# 以這些字首開頭的狀態視為暫時性失敗 (含 Scholar 的 "Error: ..."，例如 SerpAPI 額度用盡)，不寫入快取
+_TRANSIENT_STATUSES = ("Error", "Conn Error", "Auth Error", "HTTP 429", "HTTP 5", "No API Key")
+
+@st.cache_resource(show_spinner=False)
+def get_cache_db():
+    # 整個 process 共用一條連線 (rerun 時不會重開、也不會留下沒關閉的連線)；
+    # 連線在第一次查詢時才建立，所有存取都要持有 lock
+    return {"conn": None, "lock": threading.Lock()}
+
+def _get_cache_conn(db):
+    # 呼叫端須已持有 db["lock"]
+    if db["conn"] is None:
+        conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs("
+            "key TEXT PRIMARY KEY, source TEXT, url TEXT, status TEXT, ts INT, confidence REAL)"
+        )
+        # 舊版快取檔沒有 confidence 欄位，補上即可沿用 (舊資料的信心度為 NULL)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(refs)")]
+        if "confidence" not in columns:
+            conn.execute("ALTER TABLE refs ADD COLUMN confidence REAL")
+        conn.commit()
+        db["conn"] = conn
+    return db["conn"]
+
+def cache_get(source, key):
+    try:
+        db = get_cache_db()
+        with db["lock"]:
+            row = _get_cache_conn(db).execute(
+                "SELECT url, status, ts, confidence FROM refs WHERE key = ?", (f"{source}:{key}",)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    url, status, ts, confidence = row
+    if not url and time.time() - ts > NEGATIVE_CACHE_TTL:
+        return None
+    return url, status, confidence
+
+def cache_set(source, key, url, status, confidence=None):
+    # 連線錯誤、額度用盡等暫時性失敗不寫入，下次仍會重新查詢
+    if not url and str(status).startswith(_TRANSIENT_STATUSES):
+        return
+    try:
+        db = get_cache_db()
+        with db["lock"]:
+            conn = _get_cache_conn(db)
+            conn.execute(
+                "INSERT OR REPLACE INTO refs(key, source, url, status, ts, confidence) VALUES (?, ?, ?, ?, ?, ?)",
+                (f"{source}:{key}", source, url, status, int(time.time()), confidence)
+            )
+            conn.commit()
+    except sqlite3.Error:
+        pass
+
+def cached_lookup(source, key, lookup, force_refresh=False):
+    """
+    先查快取，沒有 (或強制重新查詢) 才呼叫 lookup()。
+    lookup 回傳 (url, status) 或 (url, status, confidence)，本函式一律回傳 (url, status, confidence)。
+    """
+    if not force_refresh:
+        hit = cache_get(source, key)
+        if hit is not None:
+            return hit
+    result = lookup()
+    url, status = result[0], result[1]
+    confidence = result[2] if len(result) > 2 else None
+    cache_set(source, key, url, status, confidence)
+    return url, status, confidence
+
 # ==============================================================================
 # 5. 主程式核心邏輯 (check_single_task)
 # ==============================================================================
@@ -551,12 +1159,17 @@ def format_name_field(data):
     if isinstance(data, list): return "; ".join(map(str, data))
     return str(data)
 
+_URL_RE = re.compile(r'(https?://[^\s]+)')
+# 標題開頭的年份與結尾的 arXiv 字樣合併成一個 Regex，一次掃描完成
+_TITLE_CLEAN_RE = re.compile(r'(?i)^\s*\d{4}[\.\s]+|\.?\s*arXiv.*$')
+
 def refine_parsed_data(parsed_item):
     item = parsed_item.copy()
     raw_text = item.get('text', '').strip()
     
-    if not item.get('url'):
-        url_match = re.search(r'(https?://[^\s]+)', raw_text)
+    # 大多數文獻沒有網址，先用子字串檢查略過 Regex 掃描
+    if not item.get('url') and 'http' in raw_text:
+        url_match = _URL_RE.search(raw_text)
         if url_match: item['url'] = url_match.group(1).strip(' .')
 
     for key in ['doi', 'url', 'title', 'date']:
@@ -565,21 +1178,80 @@ def refine_parsed_data(parsed_item):
 
     title = item.get('title', '')
     if title:
-        title = re.sub(r'^\s*\d{4}[\.\s]+', '', title)
-        title = re.sub(r'(?i)\.?\s*arXiv.*$', '', title)
+        title = _TITLE_CLEAN_RE.sub('', title)
         item['title'] = title
         
     return item
 
-def check_single_task(idx, raw_ref, local_df, target_col, scopus_key, serpapi_key):
-    ref = refine_parsed_data(raw_ref)
+def _task_query_fields(ref):
     title, text = ref.get('title', ''), ref.get('text', '')
     search_query = title if (title and len(title) > 8) else text[:120]
-    doi, parsed_url = ref.get('doi'), ref.get('url')
-    
-    # 提取第一作者
     authors_str = ref.get('authors', '')
-    first_author = authors_str.split(';')[0].split(',')[0].strip() if authors_str else ""
+    first_author = authors_str.partition(';')[0].partition(',')[0].strip() if authors_str else ""
+    return title, text, search_query, first_author
+
+def task_dedup_key(raw_ref):
+    """
+    check_single_task 的結果只取決於這些欄位，相同鍵的文獻只需要查一次。
+    除了 DOI、查詢字串、作者與網址，原文 (Scholar 原文查詢與建議連結) 與標題 (比對目標) 也會影響結果。
+    """
+    ref = refine_parsed_data(raw_ref)
+    title, text, search_query, first_author = _task_query_fields(ref)
+    return (
+        str(ref.get('doi') or '').strip().lower(),
+        clean_title(search_query),
+        clean_title(title),
+        clean_title(text),
+        first_author.lower(),
+        str(ref.get('url') or '')
+    )
+
+def copy_result_for_duplicate(res, idx, raw_ref):
+    ref = refine_parsed_data(raw_ref)
+    return {**res, "id": idx, "title": ref.get('title', ''), "text": ref.get('text', ''), "parsed": ref}
+
+def needs_local_lookup(raw_ref):
+    # 只有含中文的文獻才查本地資料庫 (台灣博碩士論文)
+    title, _, search_query, _ = _task_query_fields(refine_parsed_data(raw_ref))
+    return bool(title) and _has_cjk(search_query)
+
+def prefetch_local_matches(raw_refs, local_df, target_col, threshold=0.85, title_index=None):
+    """
+    在派送任務前，把所有需要查本地資料庫的文獻一次批次比對，回傳 {index: 是否命中}。
+    """
+    if local_df is None:
+        return {}
+    indices = [i for i, r in enumerate(raw_refs) if needs_local_lookup(r)]
+    titles = [refine_parsed_data(raw_refs[i]).get('title', '') for i in indices]
+    matches = search_local_database_batch(local_df, target_col, titles, threshold=threshold, title_index=title_index)
+    return {i: row is not None for i, (row, _) in zip(indices, matches)}
+
+def crossref_doi_cache_key(ref):
+    _, _, _, first_author = _task_query_fields(ref)
+    return f"{str(ref.get('doi') or '').strip().lower()}|{clean_title(ref.get('title') or '')}|{first_author.lower()}"
+
+def prefetch_crossref_dois(raw_refs, force_refresh=False):
+    """
+    在派送任務前，把尚未快取的 DOI 以批次請求一次取回，回傳 {index: Crossref item}。
+    """
+    refs = {i: refine_parsed_data(r) for i, r in enumerate(raw_refs)}
+    wanted = {
+        i: _clean_doi(ref['doi']).lower() for i, ref in refs.items()
+        if ref.get('doi') and (force_refresh or cache_get("crossref_doi", crossref_doi_cache_key(ref)) is None)
+    }
+    items = fetch_crossref_items_by_dois(wanted.values()) if wanted else {}
+    return {i: items[d] for i, d in wanted.items() if d in items}
+
+def check_single_task(idx, raw_ref, local_df, target_col, scopus_key, serpapi_key, force_refresh=False, local_hit=None, crossref_item=None, title_index=None):
+    ref = refine_parsed_data(raw_ref)
+    # 標題、原文、查詢字串與第一作者
+    title, text, search_query, first_author = _task_query_fields(ref)
+    doi, parsed_url = ref.get('doi'), ref.get('url')
+
+    # 快取鍵：清洗後的標題 + 作者 (DOI 查詢另以 DOI 為鍵)
+    query_key = f"{clean_title(search_query)}|{first_author.lower()}"
+    # Scholar 查不到標題時會改用原文查詢，結果也取決於原文
+    scholar_key = f"{query_key}|{clean_title(text)}"
 
     res = {
         "id": idx,
@@ -588,59 +1260,138 @@ def check_single_task(idx, raw_ref, local_df, target_col, scopus_key, serpapi_ke
         "parsed": ref,
         "sources": {},
         "found_at_step": None,
+        "confidence": None,
         "suggestion": None
     }
 
-    # 0. Local Database
-    if bool(re.search(r'[\u4e00-\u9fff]', search_query)) and local_df is not None and title:
-        match_row, _ = search_local_database(local_df, target_col, title, threshold=0.85)
-        if match_row is not None:
-            res.update({"sources": {"Local DB": "Matched"}, "found_at_step": "0. Local Database"})
-            return res
-
-    # 1. DOI / Crossref
-    if doi:
-        _, url, _ = search_crossref_by_doi(doi, target_title=title if title else None)
-        if url:
-            res.update({"sources": {"Crossref": url}, "found_at_step": "1. Crossref (DOI)"})
-            return res
-
-    url, _ = search_crossref_by_text(search_query, first_author)
-    if url:
-        res.update({"sources": {"Crossref": url}, "found_at_step": "1. Crossref (Search)"})
+    # 0. Local Database (local_hit 為 prefetch_local_matches 預先批次比對的結果)
+    if local_hit is None and _has_cjk(search_query) and local_df is not None and title:
+        match_row, _ = search_local_database(local_df, target_col, title, threshold=0.85, title_index=title_index)
+        local_hit = match_row is not None
+    if local_hit:
+        res.update({"sources": {"Local DB": "Matched"}, "found_at_step": "0. Local Database"})
         return res
 
-    # 2. Scopus
+    # 1. Crossref (DOI → Search)，依優先順序採用第一個命中的結果；Crossref 命中就不再查 Scopus / Scholar (信心度只寫進報告)
+    crossref_stages = []
+    if doi:
+        doi_key = crossref_doi_cache_key(ref)
+        crossref_stages.append(("1. Crossref (DOI)", lambda: cached_lookup(
+            "crossref_doi", doi_key,
+            lambda: search_crossref_by_doi(doi, target_title=title if title else None, author=first_author, item=crossref_item)[1:],
+            force_refresh
+        )))
+    crossref_stages.append(("1. Crossref (Search)", lambda: cached_lookup(
+        "crossref", query_key,
+        lambda: search_crossref_by_text(search_query, first_author),
+        force_refresh
+    )))
+
+    # DOI 結果已在手邊 (預先批次取回或已有快取) 時不必連網，直接在本執行緒判斷，查不到才做文字搜尋
+    doi_ready = doi and (crossref_item is not None or (not force_refresh and cache_get("crossref_doi", doi_key) is not None))
+    if len(crossref_stages) == 1 or doi_ready:
+        for step, lookup in crossref_stages:
+            try:
+                url, _, confidence = lookup()
+            except Exception:
+                continue
+            if url:
+                res.update({"sources": {"Crossref": url}, "found_at_step": step, "confidence": confidence})
+                return res
+    else:
+        # DOI 需要連網查詢：與文字搜尋同時發出 (每筆文獻的等待時間從兩者加總變成較慢的那一個)
+        stage_pool = ThreadPoolExecutor(max_workers=2)
+        futures = [(step, stage_pool.submit(lookup)) for step, lookup in crossref_stages]
+        try:
+            for step, future in futures:
+                try:
+                    url, _, confidence = future.result()
+                except Exception:
+                    continue
+                if url:
+                    res.update({"sources": {"Crossref": url}, "found_at_step": step, "confidence": confidence})
+                    return res
+        finally:
+            # DOI 已命中就不等待文字搜尋 (背景完成後仍會寫入快取)
+            stage_pool.shutdown(wait=False, cancel_futures=True)
+
+    # 2. Scopus (有配額限制，只在 Crossref 查不到時才呼叫)
     if scopus_key:
-        url, _ = search_scopus_by_title(search_query, scopus_key, author=first_author)
+        try:
+            url, _, confidence = cached_lookup(
+                "scopus", query_key,
+                lambda: search_scopus_by_title(search_query, scopus_key, author=first_author),
+                force_refresh
+            )
+        except Exception:
+            url = None
         if url:
-            res.update({"sources": {"Scopus": url}, "found_at_step": "2. Scopus"})
+            res.update({"sources": {"Scopus": url}, "found_at_step": "2. Scopus", "confidence": confidence})
             return res
 
-    # 5. Google Scholar
+    # 5. Google Scholar (SerpAPI 按次計費，只在免費來源都查不到時才呼叫)
     if serpapi_key:
-        url, step_name = search_scholar_by_title(search_query, serpapi_key, author=first_author, raw_text=text)
+        url, step_name, _ = cached_lookup(
+            "scholar", scholar_key,
+            lambda: search_scholar_by_title(search_query, serpapi_key, author=first_author, raw_text=text),
+            force_refresh
+        )
         if url:
             res.update({"sources": {"Scholar": url}, "found_at_step": f"5. Google Scholar ({step_name})"})
             return res
 
         # Fallback suggestion
-        url_r, _ = search_scholar_by_ref_text(text, serpapi_key, target_title=title)
+        url_r, _, _ = cached_lookup(
+            "scholar_ref", f"{clean_title(text)}|{clean_title(title)}",
+            lambda: search_scholar_by_ref_text(text, serpapi_key, target_title=title),
+            force_refresh
+        )
         if url_r: res["suggestion"] = url_r
 
     # 6. Direct Link Check
     if parsed_url and parsed_url.startswith('http'):
-        if check_url_availability(parsed_url):
+        if check_url_availability(parsed_url, force_refresh):
             res.update({"sources": {"Direct Link": parsed_url}, "found_at_step": "6. Website"})
         else:
             res.update({"sources": {"Direct Link (Dead)": parsed_url}, "found_at_step": "6. Website (Failed)"})
 
     return res
 
+def results_to_columns(results):
+    """
+    將驗證結果 (list of dict) 一次轉成報告用的欄位 {欄名: list}。
+    """
+    columns = {"ID": [], "Status": [], "Confidence": [], "Title": [], "Source": [], "Original": [], "Error_Log": []}
+    for r in results:
+        columns["ID"].append(r['id'])
+        columns["Status"].append(r['found_at_step'] or "Not Found")
+        columns["Confidence"].append(r.get('confidence'))
+        columns["Title"].append(r['title'])
+        columns["Source"].append(next(iter(r['sources'].values()), "N/A") if r['sources'] else "N/A")
+        columns["Original"].append(r['text'])
+        columns["Error_Log"].append(r.get('error', ''))  # 加入錯誤紀錄欄位
+    return columns
+
+def summarize_results(results):
+    # 統計數據只在產生結果時算一次 (資料庫驗證成功 = 有命中且不是網站檢查)
+    verified = 0
+    for r in results:
+        step = r.get('found_at_step')
+        if step and "6." not in step:
+            verified += 1
+    return {"total": len(results), "verified": verified}
+
+def build_report_csv(results):
+    # 準備下載用的 DataFrame (直接以欄位建立，不必先組出每列一個 dict)
+    df_export = pd.DataFrame(results_to_columns(results))
+    return df_export.to_csv(index=False).encode('utf-8-sig')
+
 # ==============================================================================
 # 6. UI 主程式
 # ==============================================================================
 
+PROGRESS_UPDATE_INTERVAL = 0.05  # 秒
+
 # Sidebar
 with st.sidebar:
     st.header("⚙️ System Settings")
@@ -653,17 +1404,20 @@ with st.sidebar:
         st.info("請確認 packages.txt 已包含 ruby-full 並重啟 APP")
 
     DEFAULT_CSV_PATH = "112ndltd.csv"
-    local_df, target_col = None, None
+    local_df, target_col, title_index = None, None, None
     if os.path.exists(DEFAULT_CSV_PATH):
-        local_df = load_csv_data(DEFAULT_CSV_PATH)
+        csv_mtime = os.path.getmtime(DEFAULT_CSV_PATH)
+        local_df, target_col = load_local_database(DEFAULT_CSV_PATH, csv_mtime)
+        title_index = load_title_index(DEFAULT_CSV_PATH, csv_mtime)
         if local_df is not None:
             st.success(f"Local DB: {len(local_df)} records")
-            target_col = "論文名稱" if "論文名稱" in local_df.columns else local_df.columns[0]
 
     scopus_key = get_scopus_key()
     serpapi_key = get_serpapi_key()
     st.write(f"Scopus: {'✅' if scopus_key else '❌'} | SerpAPI: {'✅' if serpapi_key else '❌'}")
 
+    force_refresh = st.checkbox("🔄 Force refresh (忽略查詢快取)", value=False)
+
 # Main
 st.markdown('<h1 style="text-align:center; color:#4F46E5;">📚 自動化文獻驗證系統</h1>', unsafe_allow_html=True)
 st.markdown('<p style="text-align:center;">整合 AnyStyle 解析與多重資料庫 (Crossref, Scopus, Google Scholar) 驗證</p>', unsafe_allow_html=True)
@@ -675,6 +1429,8 @@ if st.button("🚀 開始驗證", type="primary", use_container_width=True):
         st.warning("⚠️ 請輸入內容")
     else:
         st.session_state.results = []
+        st.session_state.report_csv = None
+        st.session_state.summary = None
         with st.status("🔍 執行中...", expanded=True) as status:
             status.write("正在解析格式 (AnyStyle)...")
             _, struct_list = parse_references_with_anystyle(raw_input)
@@ -682,19 +1438,47 @@ if st.button("🚀 開始驗證", type="primary", use_container_width=True):
             if struct_list:
                 status.write(f"解析成功 ({len(struct_list)} 筆)，開始查詢資料庫...")
                 progress_bar = st.progress(0)
-                results_buffer = []
+                # 依原始順序預先配置，完成時直接放到對應位置，不必事後排序
+                results_buffer = [None] * len(struct_list)
+
+                # 重複的文獻 (同 DOI / 標題 / 作者 / 網址) 只查一次，結果再分給每一筆
+                groups = {}
+                for i, r in enumerate(struct_list):
+                    groups.setdefault(task_dedup_key(r), []).append(i)
+
+                leaders = [idxs[0] for idxs in groups.values()]
+                local_hits = prefetch_local_matches([struct_list[i] for i in leaders], local_df, target_col, title_index=title_index)
+                local_hits = {leaders[k]: hit for k, hit in local_hits.items()}
+                # 有 DOI 的文獻先批次向 Crossref 取回 metadata (本地已命中的不必查)
+                doi_leaders = [i for i in leaders if not local_hits.get(i)]
+                crossref_items = prefetch_crossref_dois([struct_list[i] for i in doi_leaders], force_refresh)
+                crossref_items = {doi_leaders[k]: item for k, item in crossref_items.items()}
 
                 with ThreadPoolExecutor(max_workers=5) as executor:
                     futures = {
                         executor.submit(
-                            check_single_task, i+1, r, local_df, target_col, scopus_key, serpapi_key
-                        ): i for i, r in enumerate(struct_list)
+                            check_single_task, idxs[0]+1, struct_list[idxs[0]], local_df, target_col, scopus_key, serpapi_key, force_refresh,
+                            local_hits.get(idxs[0], False), crossref_items.get(idxs[0])
+                        ): idxs for idxs in groups.values()
                     }
-                    for i, future in enumerate(as_completed(futures)):
-                        results_buffer.append(future.result())
-                        progress_bar.progress((i + 1) / len(struct_list))
-
-                st.session_state.results = sorted(results_buffer, key=lambda x: x['id'])
+                    done, last_tick = 0, 0.0
+                    for future in as_completed(futures):
+                        res = future.result()
+                        first, *duplicates = futures[future]
+                        results_buffer[first] = res
+                        for i in duplicates:
+                            results_buffer[i] = copy_result_for_duplicate(res, i+1, struct_list[i])
+                        done += len(futures[future])
+                        # 進度條每次更新都要送一次 websocket 訊息，最多每 50ms 更新一次 (最後一筆一定更新)
+                        now = time.monotonic()
+                        if now - last_tick >= PROGRESS_UPDATE_INTERVAL or done == len(struct_list):
+                            progress_bar.progress(done / len(struct_list))
+                            last_tick = now
+
+                st.session_state.results = results_buffer
+                # 報告 CSV 只在產生結果時建立一次，之後展開/收合等 rerun 直接沿用
+                st.session_state.report_csv = build_report_csv(st.session_state.results)
+                st.session_state.summary = summarize_results(st.session_state.results)
                 status.update(label="✅ 驗證完成！", state="complete", expanded=False)
             else:
                 status.update(label="❌ 解析失敗", state="error")
@@ -704,9 +1488,9 @@ if st.button("🚀 開始驗證", type="primary", use_container_width=True):
 if "results" in st.session_state and st.session_state.results:
     st.divider()
     
-    # 計算統計數據
-    total = len(st.session_state.results)
-    verified = sum(1 for r in st.session_state.results if r.get('found_at_step') and "6." not in r.get('found_at_step'))
+    # 統計數據 (驗證完成時已計算)
+    summary = st.session_state.get("summary") or summarize_results(st.session_state.results)
+    total, verified = summary["total"], summary["verified"]
     
     # 顯示 Metrics
     c1, c2, c3 = st.columns(3)
@@ -714,18 +1498,8 @@ if "results" in st.session_state and st.session_state.results:
     c2.metric("資料庫驗證成功", verified)
     c3.metric("需人工確認", total - verified)
 
-    # 準備下載用的 DataFrame
-    df_export = pd.DataFrame([{
-        "ID": r['id'],
-        "Status": r['found_at_step'] or "Not Found",
-        "Title": r['title'],
-        "Source": next(iter(r['sources'].values()), "N/A") if r['sources'] else "N/A",
-        "Original": r['text'],
-        "Error_Log": r.get('error', '') # 加入錯誤紀錄欄位
-    } for r in st.session_state.results])
-    
-    # 下載按鈕
-    csv_data = df_export.to_csv(index=False).encode('utf-8-sig')
+    # 下載按鈕 (CSV 在驗證完成時已建立)
+    csv_data = st.session_state.get("report_csv") or build_report_csv(st.session_state.results)
     st.download_button(
         label="📥 下載報告 (CSV)",
         data=csv_data,
@@ -752,6 +1526,8 @@ if "results" in st.session_state and st.session_state.results:
                     st.info("💡 提示: 請確認 GitHub 根目錄有 packages.txt 且已執行 Reboot App。")
             
             st.write(f"**狀態**: {step or '未找到'}")
+            if item.get('confidence') is not None:
+                st.write(f"**信心度**: {item['confidence']:.2f}" + ("" if item['confidence'] >= CONFIDENT_MATCH_THRESHOLD else " (不確定，建議人工確認)"))
             st.write(f"**原始文字**: {item['text']}")
             
             if item.get('sources'): 
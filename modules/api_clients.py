@@ -1,11 +1,16 @@
 # modules/api_clients.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz
 from serpapi import GoogleSearch
 import urllib3
 import re
+import threading
+from urllib.parse import urlparse
+import functools
 
 # 導入標題清洗函式
 from .parsers import clean_title
@@ -14,9 +19,72 @@ from .parsers import clean_title
 S2_API_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
 OPENALEX_API_URL = "https://api.openalex.org/works"
 
-MAX_RETRIES = 2
 TIMEOUT = 10
 
+# 共用連線池：重用 TCP/TLS 連線，重試交給 urllib3 (含指數退避與 Retry-After)
+SESSION = requests.Session()
+_RETRY_OPTIONS = dict(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET", "HEAD"],
+    raise_on_status=False
+)
+try:
+    # 退避時間加上隨機抖動，避免多個執行緒同時重試 (backoff_jitter 需要 urllib3 2.x)
+    _retry = Retry(**_RETRY_OPTIONS, backoff_jitter=0.3)
+except TypeError:
+    _retry = Retry(**_RETRY_OPTIONS)
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=_retry
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+# 預設標頭只設定一次，各請求傳入的 headers 會與之合併 (例如 Scopus 的 API Key)
+SESSION.headers.update({'User-Agent': 'ReferenceChecker/1.0'})
+
+# 網址存活探測另用一個不重試的 Session：目標是任意網站，逾時或 503 (含 Retry-After) 本身就是要回報的結果，
+# 交給 urllib3 重試只會讓每個失效網址卡住工作執行緒數十秒
+PROBE_SESSION = requests.Session()
+_probe_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0)
+PROBE_SESSION.mount("https://", _probe_adapter)
+PROBE_SESSION.mount("http://", _probe_adapter)
+# 網址探測使用 verify=False，載入時關閉一次警告即可 (不必每次請求都修改全域 warning filter)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 各 API 主機每秒可發出的請求數 (token bucket)，未列出的主機不限速
+HOST_RATE_LIMITS = {
+    "api.crossref.org": 10,
+    "api.elsevier.com": 5,
+    "api.semanticscholar.org": 1,
+    "api.openalex.org": 10,
+    "serpapi.com": 2,
+}
+_rate_buckets = {}  # host -> (剩餘 token, 上次補充時間)
+_rate_buckets_lock = threading.Lock()
+
+def _wait_for_rate_limit(url):
+    """
+    依主機的 token bucket 等待到可以發出下一個請求為止。
+    """
+    host = urlparse(url).netloc or url
+    rate = HOST_RATE_LIMITS.get(host)
+    if not rate:
+        return
+    while True:
+        with _rate_buckets_lock:
+            now = time.monotonic()
+            tokens, last = _rate_buckets.get(host, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens >= 1:
+                _rate_buckets[host] = (tokens - 1, now)
+                return
+            _rate_buckets[host] = (tokens, now)
+            wait = (1 - tokens) / rate
+        time.sleep(wait)
+
 # ========== API Key 管理 ==========
 def get_scopus_key():
     return st.secrets.get("scopus_api_key") or _read_key_file("scopus_key.txt")
@@ -34,20 +102,15 @@ def _read_key_file(filename):
 # ========== [核心] 1. 作者比對邏輯 (新增) ==========
 # 修改 modules/api_clients.py 中的 _check_author_match
 
-def _check_author_match(query_author, result_authors_list):
+# 常見姓氏：撞名機率高，必須再比對名字首字母
+_COMMON_SURNAMES = frozenset({'wang', 'chen', 'lee', 'li', 'zhang', 'liu', 'lin', 'yang', 'huang', 'wu', 'smith', 'jones'})
+
+@functools.lru_cache(maxsize=4096)
+def _parse_query_author(query_author):
     """
-    嚴格比對函式：專門解決 Zhang, X. 與 L. Zhang 被誤判為同一人的問題。
-    邏輯：
-    1. 拆解輸入作者的 姓 (Family) 與 名 (Given)。
-    2. 針對常見姓氏 (Zhang, Li 等)，強制檢查名字首字母是否一致。
-    3. 如果首字母不同 (X vs L)，直接視為不同人。
+    拆解輸入作者為 (姓, 名字首字母, 是否為大姓)。
+    同一位作者會跟每個候選結果的每位作者比對，因此快取拆解結果。
     """
-    if not query_author or len(query_author) < 2:
-        return True 
-    
-    query_author = query_author.lower().strip()
-    
-    # --- 步驟 1: 解析您的輸入 (例如: "Zhang, X.") ---
     # 預設變數
     q_family = ""
     q_given_initial = ""
@@ -66,11 +129,34 @@ def _check_author_match(query_author, result_authors_list):
         if len(parts) > 1:
             q_given_initial = parts[0].strip()[0]
 
-    # 定義必須嚴格檢查的大姓
-    common_names = ['wang', 'chen', 'lee', 'li', 'zhang', 'liu', 'lin', 'yang', 'huang', 'wu', 'smith', 'jones']
-    
     # 判斷是否為大姓 (如果是，我們就一定要對首字母)
-    is_common_name = (q_family in common_names)
+    return q_family, q_given_initial, q_family in _COMMON_SURNAMES
+
+@functools.lru_cache(maxsize=4096)
+def _parse_result_author(author):
+    """
+    拆解字串格式的結果作者 (假設 "L. Zhang") 為 (姓, 名字首字母, 全名)。
+    同一位作者常出現在多個候選結果與多次查詢中，因此快取拆解結果。
+    """
+    r_full = author.lower()
+    if " " in r_full:
+        parts = r_full.split()
+        return parts[-1], parts[0][0], r_full
+    return r_full, "", r_full
+
+def _check_author_match(query_author, result_authors_list):
+    """
+    嚴格比對函式：專門解決 Zhang, X. 與 L. Zhang 被誤判為同一人的問題。
+    邏輯：
+    1. 拆解輸入作者的 姓 (Family) 與 名 (Given)。
+    2. 針對常見姓氏 (Zhang, Li 等)，強制檢查名字首字母是否一致。
+    3. 如果首字母不同 (X vs L)，直接視為不同人。
+    """
+    if not query_author or len(query_author) < 2:
+        return True 
+    
+    # --- 步驟 1: 解析您的輸入 (例如: "Zhang, X.") ---
+    q_family, q_given_initial, is_common_name = _parse_query_author(query_author.lower().strip())
 
     # --- 步驟 2: 檢查系統抓到的作者列表 (例如: ["L. Zhang", "L. Xu", ...]) ---
     for auth in result_authors_list:
@@ -85,13 +171,7 @@ def _check_author_match(query_author, result_authors_list):
             if given: r_given_initial = given[0]
             r_full = f"{given} {r_family}".strip()
         else:
-            r_full = str(auth).lower()
-            # 簡單拆解字串 (假設 "L. Zhang")
-            if " " in r_full:
-                r_family = r_full.split()[-1] # 抓 "zhang"
-                r_given_initial = r_full.split()[0][0] # 抓 "l"
-            else:
-                r_family = r_full
+            r_family, r_given_initial, r_full = _parse_result_author(str(auth))
 
         # --- 步驟 3: 關鍵比對 (Zhang vs Zhang) ---
         
@@ -113,6 +193,21 @@ def _check_author_match(query_author, result_authors_list):
     return False
 
 # ========== [核心] 2. 標題比對邏輯 (包含您之前的寬鬆優化) ==========
+
+# 去噪用的 Regex (模組載入時編譯一次)
+# 4 位數年份與 arXiv、Available、Online 等字眼合併成一個 Regex，一次掃描全部移除
+_NOISE_RE = re.compile(r'\b(?:(?:19|20)\d{2}|arxiv|biorxiv|available|online|access)\b', re.IGNORECASE)
+_STOP_WORDS = frozenset({'a', 'an', 'the', 'of', 'in', 'for', 'with', 'on', 'at', 'by', 'and', 'from', 'to'})
+
+def remove_noise(text):
+    """
+    移除常見的非標題字眼，避免它們導致比對失敗。
+    """
+    # 移除 4位數年份 (如 2023, 2024) 與 arXiv, bioRxiv, Available, Online 等字眼
+    text = _NOISE_RE.sub('', text)
+    # 移除多餘空白
+    return " ".join(text.split())
+
 # 在 modules/api_clients.py 中找到 _is_match 函式並修改
 
 def _is_match(query, result):
@@ -122,36 +217,34 @@ def _is_match(query, result):
     if not c_q or not c_r: return False
         
     # --- 新增：強效去噪 ---
-    # 移除常見的非標題字眼，避免它們導致比對失敗
-    def remove_noise(text):
-        # 移除 4位數年份 (如 2023, 2024)
-        text = re.sub(r'\b(19|20)\d{2}\b', '', text)
-        # 移除 arXiv, bioRxiv, Available, Online 等字眼
-        text = re.sub(r'\b(arxiv|biorxiv|available|online|access)\b', '', text, flags=re.IGNORECASE)
-        # 移除多餘空白
-        return " ".join(text.split())
-
-    c_q = remove_noise(c_q)
-    c_r = remove_noise(c_r)
-    # ---------------------
+    return _is_match_cleaned(remove_noise(c_q), remove_noise(c_r))
 
+@functools.lru_cache(maxsize=8192)
+def _is_match_cleaned(c_q, c_r):
+    """
+    _is_match 的核心比對 (輸入為清洗、去噪後的標題)。
+    同一組標題在各階段可能被重複比對，結果只取決於這兩個字串，因此可以快取。
+    """
     # 1. 針對 Query 是長段落... (維持原樣)
     if len(c_q) > len(c_r) * 1.5:
         if c_r in c_q: return True
 
-    # 2. 相似度比對 (維持原樣)
-    ratio = SequenceMatcher(None, c_q, c_r).ratio()
-    if ratio >= 0.65: return True  # 建議稍微調降到 0.8 以容忍少許差異
+    # 2. 相似度比對
+    # score_cutoff 讓 RapidFuzz 依長度上限提早放棄，低於門檻時回傳 0
+    # fuzz.ratio (Indel) 一定不低於 SequenceMatcher 的分數，沿用 0.65 會放過更多假標題；
+    # 門檻提高到 0.70，讓通過率接近原本 SequenceMatcher >= 0.65 的水準
+    ratio = fuzz.ratio(c_q, c_r, score_cutoff=70) / 100
+    if ratio >= 0.70: return True  # 建議稍微調降到 0.8 以容忍少許差異
     
     # 3. 關鍵字比對
     q_words = set(c_q.split())
     r_words = set(c_r.split())
-    stop_words = {'a', 'an', 'the', 'of', 'in', 'for', 'with', 'on', 'at', 'by', 'and', 'from', 'to'} # 增加一些介係詞
     
     # ... (中間省略) ...
 
     # 反向檢查 (Query 的重要單字都在 Result 裡)
-    missing_important_in_result = [w for w in q_words if w not in stop_words and w not in r_words]
+    # 集合差集在 C 層完成 (停用詞見 _STOP_WORDS)
+    missing_important_in_result = q_words - r_words - _STOP_WORDS
     
     # --- 新增：容錯機制 ---
     # 如果只差 1 個字，且那個字很短或是數字，我們就當作它是雜訊，予以通過
@@ -169,13 +262,12 @@ def _is_match(query, result):
 
 # --- API 呼叫輔助 ---
 def _call_external_api_with_retry(url: str, params: dict, headers=None):
-    if not headers: headers = {'User-Agent': 'ReferenceChecker/1.0'}
-    for _ in range(MAX_RETRIES):
-        try:
-            response = requests.get(url, params=params, headers=headers, timeout=TIMEOUT)
-            if response.status_code == 200: return response.json(), "OK"
-            if response.status_code in [401, 403]: return None, f"Auth Error ({response.status_code})"
-        except: pass
+    try:
+        _wait_for_rate_limit(url)
+        response = SESSION.get(url, params=params, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 200: return response.json(), "OK"
+        if response.status_code in [401, 403]: return None, f"Auth Error ({response.status_code})"
+    except: pass
     return None, "Error"
 
 # ========== 1. Crossref (含作者比對) ==========
@@ -185,7 +277,8 @@ def search_crossref_by_doi(doi, target_title=None):
     clean_doi = doi.strip(' ,.;)]}>')
     url = f"https://api.crossref.org/works/{clean_doi}"
     try:
-        response = requests.get(url, timeout=5)
+        _wait_for_rate_limit(url)
+        response = SESSION.get(url, timeout=5)
         if response.status_code == 200:
             item = response.json().get("message", {})
             titles = item.get("title", [])
@@ -260,6 +353,8 @@ def search_scopus_by_title(title, api_key, author=None):
 # ========== 3. Google Scholar (無作者欄位，維持原樣) ==========
 
 
+_ET_AL_RE = re.compile(r'(?i)[\(\[]?\bet\.?\s*al\.?[\)\]]?')
+
 def search_scholar_by_title(title, api_key, author=None, raw_text=None):
     """
     階層式搜尋策略 (適應混合格式) - 修正版：
@@ -272,6 +367,7 @@ def search_scholar_by_title(title, api_key, author=None, raw_text=None):
     def _do_search(query_string, match_mode, required_author=None):
         try:
             params = {"engine": "google_scholar", "q": query_string, "api_key": api_key, "num": 10}
+            _wait_for_rate_limit("serpapi.com")
             results = GoogleSearch(params).get_dict()
             organic = results.get("organic_results", [])
             
@@ -308,7 +404,7 @@ def search_scholar_by_title(title, api_key, author=None, raw_text=None):
     valid_search_author = None
     if author:
         # 1. 先把 (et al), [et al], et al. 全部拿掉
-        cleaned = re.sub(r'(?i)[\(\[]?\bet\.?\s*al\.?[\)\]]?', '', author).strip()
+        cleaned = _ET_AL_RE.sub('', author).strip()
         # 2. 清理乾淨後，把頭尾多餘的標點符號修剪掉
         cleaned = cleaned.strip(' .,;()[]')
         if len(cleaned) > 1:
@@ -342,6 +438,7 @@ def search_scholar_by_ref_text(ref_text, api_key, target_title=None):
     if not api_key: return None, "No API Key"
     params = {"engine": "google_scholar", "q": ref_text, "api_key": api_key, "num": 1}
     try:
+        _wait_for_rate_limit("serpapi.com")
         results = GoogleSearch(params).get_dict()
         organic = results.get("organic_results", [])
         if organic:
@@ -405,9 +502,8 @@ def check_url_availability(url):
     if url.count('/') < 3: 
         return False
         
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     try:
-        resp = requests.head(url, timeout=5, allow_redirects=True, verify=False)
+        resp = PROBE_SESSION.head(url, timeout=5, allow_redirects=True, verify=False)
         return 200 <= resp.status_code < 400
 
     except: return False
\ No newline at end of file
@@ -5,6 +5,8 @@ import google.generativeai as genai
 import json
 import re
 
+_JSON_FENCE_RE = re.compile(r'```json\n(.*?)\n```', re.DOTALL)
+
 # --- 初始化 Gemini 模型 (接收使用者輸入的 key) ---
 def get_gemini_model(api_key):
     """
@@ -88,7 +90,7 @@ def parse_document_with_gemini(model, paragraphs):
         response = model.generate_content(prompt)
         
         # 清洗 Markdown 格式，確保只留下純 JSON
-        clean_json_text = re.sub(r'```json\n(.*?)\n```', r'\1', response.text, flags=re.DOTALL)
+        clean_json_text = _JSON_FENCE_RE.sub(r'\1', response.text)
 
         parsed_refs = json.loads(clean_json_text)
 
@@ -1,8 +1,10 @@
 # modules/local_db.py
 
 import pandas as pd
+import numpy as np
+import sqlite3
 import streamlit as st
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
 from .parsers import clean_title
 
 def load_csv_data(uploaded_file):
@@ -26,7 +28,90 @@ def load_csv_data(uploaded_file):
             st.error(f"讀取 CSV 失敗: {e}")
             return None
 
-def search_local_database(df, title_column, query_title, threshold=0.8):
+def clean_title_column_name(title_column):
+    return f"_clean_{title_column}"
+
+def add_clean_title_column(df, title_column):
+    """
+    預先清洗標題欄位並存成新欄位 (載入 CSV 後呼叫一次)，
+    之後每次搜尋直接讀取，不必對整欄重複清洗。
+    """
+    if df is not None and title_column in df.columns:
+        clean_column = clean_title_column_name(title_column)
+        df[clean_column] = df[title_column].astype(str).map(clean_title)
+        # 一併存下長度，搜尋時可直接向量化做長度篩選
+        df[f"{clean_column}_len"] = df[clean_column].str.len()
+    return df
+
+def _clean_title_choices(df, title_column):
+    clean_column = clean_title_column_name(title_column)
+    if clean_column in df.columns:
+        return df[clean_column].tolist()
+    return [clean_title(t) for t in df[title_column].astype(str)]
+
+def _clean_title_lengths(df, title_column, choices):
+    length_column = f"{clean_title_column_name(title_column)}_len"
+    if length_column in df.columns:
+        return df[length_column].to_numpy()
+    return np.fromiter(map(len, choices), dtype=np.int64, count=len(choices))
+
+def _length_window(clean_query, threshold):
+    """
+    fuzz.ratio 的上限是 2*min(len)/(len總和)，回傳可能達到門檻的標題長度區間。
+    """
+    q_len = len(clean_query)
+    min_len = q_len * threshold / (2 - threshold)
+    max_len = q_len * (2 - threshold) / threshold if threshold > 0 else float("inf")
+    return min_len, max_len
+
+def build_title_index(choices):
+    """
+    以 SQLite FTS5 trigram 建立清洗後標題的子字串索引 (in-memory)。
+    SQLite 版本不支援 trigram 時回傳 None，搜尋會退回逐列比對。
+    """
+    try:
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.execute("CREATE VIRTUAL TABLE titles USING fts5(clean, tokenize='trigram')")
+        conn.executemany("INSERT INTO titles(rowid, clean) VALUES (?, ?)", enumerate(choices))
+        # 完全相同的清洗後標題直接以主鍵查表 (同名標題保留第一列)
+        conn.execute("CREATE TABLE exact_titles(clean TEXT PRIMARY KEY, row INTEGER) WITHOUT ROWID")
+        conn.executemany(
+            "INSERT OR IGNORE INTO exact_titles(clean, row) VALUES (?, ?)",
+            ((clean, i) for i, clean in enumerate(choices) if clean)
+        )
+        conn.commit()
+        return conn
+    except sqlite3.Error:
+        return None
+
+def _find_contained_title(clean_query, choices, lengths=None, title_index=None):
+    if title_index is None or lengths is None or len(clean_query) < 3:
+        for i, clean_db_title in enumerate(choices):
+            if clean_db_title and (clean_query in clean_db_title or clean_db_title in clean_query):
+                return i
+        return None
+
+    # 0. 標題完全相同：主鍵查詢，不必做子字串或模糊比對
+    row = title_index.execute("SELECT row FROM exact_titles WHERE clean = ?", (clean_query,)).fetchone()
+    if row:
+        return row[0]
+
+    # 1. 資料庫標題包含查詢字串：交給 trigram 索引
+    row = title_index.execute(
+        "SELECT rowid FROM titles WHERE clean LIKE ? ORDER BY rowid LIMIT 1",
+        (f"%{clean_query}%",)
+    ).fetchone()
+    first = row[0] if row else None
+
+    # 2. 查詢字串包含資料庫標題：只可能是不比查詢長的標題
+    for i in np.flatnonzero((lengths > 0) & (lengths <= len(clean_query))):
+        if first is not None and i >= first:
+            break
+        if choices[i] in clean_query:
+            return int(i)
+    return first
+
+def search_local_database(df, title_column, query_title, threshold=0.8, title_index=None):
     """
     在 DataFrame 的指定欄位中搜尋相似標題。
     """
@@ -36,30 +121,78 @@ def search_local_database(df, title_column, query_title, threshold=0.8):
     # 清洗查詢標題
     clean_query = clean_title(query_title)
     
-    # 遍歷 CSV 中的每一列 (如果資料量>10萬筆，這裡可能需要優化，但一般論文清單夠快)
-    best_score = 0
-    best_match_row = None
-
-    # 為了效能，我們先做簡單篩選 (長度差異太大就不比對)
-    # 這裡示範逐行比對 (最準確)
-    for index, row in df.iterrows():
-        db_title = str(row[title_column])
-        clean_db_title = clean_title(db_title)
-        
-        # 快速過濾：如果標題完全包含
-        if clean_query in clean_db_title or clean_db_title in clean_query:
-            score = 1.0
-        else:
-            # 模糊比對
-            score = SequenceMatcher(None, clean_query, clean_db_title).ratio()
-        
-        if score > best_score:
-            best_score = score
-            best_match_row = row
+    # 優先使用 add_clean_title_column 預先清洗好的欄位，之後的比對交給 rapidfuzz (C++ 實作) 批次處理
+    choices = _clean_title_choices(df, title_column)
+
+    # 快速過濾：如果標題完全包含
+    lengths = _clean_title_lengths(df, title_column, choices)
+    hit = _find_contained_title(clean_query, choices, lengths, title_index)
+    if hit is not None:
+        return df.iloc[hit], 1.0
+
+    # 長度篩選 (向量化)：長度差太多的標題不可能超過門檻，直接不送進比對 (不影響結果)
+    min_len, max_len = _length_window(clean_query, threshold)
+    in_window = np.flatnonzero((lengths >= min_len) & (lengths <= max_len))
+    candidates = {int(i): choices[i] for i in in_window}
+
+    # 模糊比對：extractOne 會在 C 層掃描候選列，並隨目前最佳分數提高 cutoff 提早放棄
+    best = process.extractOne(
+        clean_query,
+        candidates,
+        scorer=fuzz.ratio,
+        score_cutoff=threshold * 100
+    )
 
     # 判斷是否超過門檻
-    if best_score >= threshold:
+    if best is not None:
+        _, score, index = best
         # 回傳找到的那一行資料 (Series)
-        return best_match_row, best_score
-    
-    return None, 0
\ No newline at end of file
+        return df.iloc[index], score / 100
+
+    return None, 0
+
+def search_local_database_batch(df, title_column, query_titles, threshold=0.8, title_index=None):
+    """
+    一次比對多個標題：所有查詢共用一次 process.cdist (多核心 C++) 算出分數矩陣。
+    回傳與 query_titles 等長的 [(row, score), ...]，格式與 search_local_database 相同。
+    """
+    if df is None or not title_column:
+        return [(None, None)] * len(query_titles)
+
+    choices = _clean_title_choices(df, title_column)
+    lengths = _clean_title_lengths(df, title_column, choices)
+    results = [(None, None) if not q else (None, 0) for q in query_titles]
+
+    pending, pending_queries = [], []
+    for qi, query_title in enumerate(query_titles):
+        if not query_title:
+            continue
+        clean_query = clean_title(query_title)
+        hit = _find_contained_title(clean_query, choices, lengths, title_index)
+        if hit is not None:
+            results[qi] = (df.iloc[hit], 1.0)
+        else:
+            pending.append(qi)
+            pending_queries.append(clean_query)
+
+    if pending:
+        # 只比對落在任一查詢長度區間內的標題
+        windows = [_length_window(q, threshold) for q in pending_queries]
+        min_len = min(w[0] for w in windows)
+        max_len = max(w[1] for w in windows)
+        in_window = np.flatnonzero((lengths >= min_len) & (lengths <= max_len))
+
+        if len(in_window):
+            scores = process.cdist(
+                pending_queries,
+                [choices[i] for i in in_window],
+                scorer=fuzz.ratio,
+                score_cutoff=threshold * 100,
+                workers=-1
+            )
+            for qi, row_scores in zip(pending, scores):
+                best = int(row_scores.argmax())
+                if row_scores[best] > 0 and row_scores[best] >= threshold * 100:
+                    results[qi] = (df.iloc[in_window[best]], row_scores[best] / 100)
+
+    return results
\ No newline at end of file
@@ -1,8 +1,9 @@
 # modules/parsers.py
 import re
+import functools
 import unicodedata
 import subprocess
-import json
+import orjson
 import streamlit as st
 import tempfile
 import os
@@ -64,9 +65,93 @@ ANYSTYLE_CMD = get_anystyle_path()
 # AnyStyle 解析主程式
 # ==============================================================================
 
+def _clean_anystyle_item(item, line):
+    cleaned_item = {}
+    for key, value in item.items():
+        if isinstance(value, list):
+            if key == "author":
+                authors = []
+                for a in value:
+                    if isinstance(a, dict):
+                        parts = [p for p in [a.get("given"), a.get("family")] if p]
+                        authors.append(" ".join(parts))
+                    else:
+                        authors.append(str(a))
+                cleaned_item["authors"] = ", ".join(authors)
+            else:
+                cleaned_item[key] = " ".join(map(str, value))
+        else:
+            cleaned_item[key] = value
+
+    if "text" not in cleaned_item:
+        cleaned_item["text"] = line
+
+    return cleaned_item
+
+
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+def _has_cjk(text):
+    # 預編譯的字元類別搜尋在 C 層逐字掃描，比 Python 迴圈比對 ord() 快
+    return bool(_CJK_RE.search(text))
+
+# AnyStyle 偶爾會在 JSON 前後輸出警告訊息，用來擷取真正的 JSON 陣列
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+
+def _run_anystyle_batch(lines, use_custom_model):
+    """
+    將多行文獻寫入同一個暫存檔 (每行一筆)，只呼叫一次 AnyStyle。
+    回傳與 lines 等長、順序一致的 JSON 物件列表。
+    """
+    with tempfile.NamedTemporaryFile(
+        mode="w",
+        suffix=".txt",
+        delete=False,
+        encoding="utf-8"
+    ) as tmp:
+        tmp.write("\n".join(lines))
+        tmp_path = tmp.name
+
+    # 組合指令
+    # 使用我們找到的絕對路徑 ANYSTYLE_CMD
+    command = [ANYSTYLE_CMD]
+    if use_custom_model:
+        command.extend(["-P", "custom.mod"])
+    command.extend(["-f", "json", "parse", tmp_path])
+
+    try:
+        process = subprocess.run(
+            command,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            check=True
+        )
+
+        stdout = process.stdout.strip()
+
+        # 擷取 JSON
+        if not stdout.startswith("["):
+            match = _JSON_ARRAY_RE.search(stdout)
+            if match:
+                stdout = match.group(0)
+
+        batch_data = orjson.loads(stdout)
+        if len(batch_data) != len(lines):
+            raise ValueError(f"AnyStyle 回傳 {len(batch_data)} 筆，但輸入為 {len(lines)} 行")
+        return batch_data
+
+    finally:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+
+
 def parse_references_with_anystyle(raw_text_for_anystyle):
     """
-    將文獻列表拆分處理，支援自動路徑偵測。
+    將文獻列表依語言分批處理 (每批只啟動一次 AnyStyle)，支援自動路徑偵測。
     """
     if not raw_text_for_anystyle or not raw_text_for_anystyle.strip():
         return [], []
@@ -75,103 +160,47 @@ def parse_references_with_anystyle(raw_text_for_anystyle):
     # st.write(f"🔧 Debug: 使用的 AnyStyle路徑: `{ANYSTYLE_CMD}`")
 
     lines = [line.strip() for line in raw_text_for_anystyle.split('\n') if line.strip()]
-    
-    structured_refs = []
-    raw_texts = []
-
-    progress_bar = st.progress(0)
-    total_lines = len(lines)
 
+    # 語言判定：中文行使用 custom.mod (確保檔案存在，否則不加參數以免報錯)
+    use_custom_model = os.path.exists("custom.mod")
+    batches = {False: [], True: []}
     for i, line in enumerate(lines):
-        # 語言判定
-        has_chinese = bool(re.search(r'[\u4e00-\u9fff]', line))
-
-        # 建立暫存檔
-        try:
-            with tempfile.NamedTemporaryFile(
-                mode="w",
-                suffix=".txt",
-                delete=False,
-                encoding="utf-8"
-            ) as tmp:
-                tmp.write(line)
-                tmp_path = tmp.name
-        except Exception as e:
-            st.error(f"❌ 無法建立暫存檔：{e}")
-            continue
+        has_chinese = _has_cjk(line)
+        batches[has_chinese and use_custom_model].append(i)
 
-        # 組合指令
-        # 使用我們找到的絕對路徑 ANYSTYLE_CMD
-        command = [ANYSTYLE_CMD]
+    parsed_by_line = [None] * len(lines)
 
-        if has_chinese:
-            # 確保 custom.mod 存在，否則不加參數以免報錯
-            if os.path.exists("custom.mod"):
-                command.extend(["-P", "custom.mod"])
-        
-        command.extend(["-f", "json", "parse", tmp_path])
+    with st.spinner(f"AnyStyle 解析中 ({len(lines)} 筆)..."):
+        for use_model, indices in batches.items():
+            if not indices:
+                continue
 
-        try:
-            process = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                check=True
-            )
-
-            stdout = process.stdout.strip()
-
-            # 擷取 JSON
-            if not stdout.startswith("["):
-                match = re.search(r"\[.*\]", stdout, re.DOTALL)
-                if match:
-                    stdout = match.group(0)
-
-            line_data = json.loads(stdout)
-
-            for item in line_data:
-                cleaned_item = {}
-                for key, value in item.items():
-                    if isinstance(value, list):
-                        if key == "author":
-                            authors = []
-                            for a in value:
-                                if isinstance(a, dict):
-                                    parts = [p for p in [a.get("given"), a.get("family")] if p]
-                                    authors.append(" ".join(parts))
-                                else:
-                                    authors.append(str(a))
-                            cleaned_item["authors"] = ", ".join(authors)
-                        else:
-                            cleaned_item[key] = " ".join(map(str, value))
-                    else:
-                        cleaned_item[key] = value
-
-                if "text" not in cleaned_item:
-                    cleaned_item["text"] = line
-
-                structured_refs.append(cleaned_item)
-                raw_texts.append(cleaned_item["text"])
+            try:
+                batch_data = _run_anystyle_batch([lines[i] for i in indices], use_model)
+                for i, item in zip(indices, batch_data):
+                    parsed_by_line[i] = _clean_anystyle_item(item, lines[i])
 
-        except Exception as e:
-            st.error(f"解析第 {i+1} 行時發生錯誤：{e}")
-            # 如果還是找不到檔案，提供詳細建議
-            if isinstance(e, FileNotFoundError):
+            except FileNotFoundError as e:
+                st.error(f"解析 {len(indices)} 行文獻時發生錯誤：{e}")
+                # 如果還是找不到檔案，提供詳細建議
                 st.warning(
                     f"💡 診斷資訊：\n"
                     f"1. 系統嘗試執行的指令是: `{ANYSTYLE_CMD}`\n"
                     f"2. 請確認 packages.txt 是否包含 `ruby-full`\n"
                     f"3. 請嘗試重啟 App (Reboot)"
                 )
-                
-        finally:
-            try:
-                os.remove(tmp_path)
+
             except Exception:
-                pass
-        
-        progress_bar.progress((i + 1) / total_lines)
+                # 批次中只要有一行出錯整批就會失敗，改成逐行重試，只略過真正解析失敗的行
+                for i in indices:
+                    try:
+                        item = _run_anystyle_batch([lines[i]], use_model)[0]
+                        parsed_by_line[i] = _clean_anystyle_item(item, lines[i])
+                    except Exception as e:
+                        st.error(f"解析第 {i+1} 行時發生錯誤：{e}")
+
+    structured_refs = [item for item in parsed_by_line if item is not None]
+    raw_texts = [item["text"] for item in structured_refs]
 
     return raw_texts, structured_refs
 
@@ -180,31 +209,36 @@ def parse_references_with_anystyle(raw_text_for_anystyle):
 # 標題清洗函式 (保持原樣)
 # ==============================================================================
 
+class _TitleCharTable(dict):
+    """
+    str.translate 用的對照表：只保留字母、數字與空白 (Unicode 類別 L/N/Z) 並轉小寫，
+    其餘字元 (含各種破折號) 直接刪除。第一次遇到的字元才計算類別，之後查表即可。
+    """
+    def __missing__(self, codepoint):
+        ch = chr(codepoint)
+        value = ch.lower() if unicodedata.category(ch)[0] in ("L", "N", "Z") else None
+        self[codepoint] = value
+        return value
+
+_TITLE_CHAR_TABLE = _TitleCharTable()
+_DASH_TABLE = str.maketrans("", "", "".join(["-", "–", "—", "−", "‐", "-"]))
+_STANDALONE_NUMBER_RE = re.compile(r"\b\d+\b")
+
+
+@functools.lru_cache(maxsize=10000)
+def _clean_title_cached(text, drop_numbers):
+    text = unicodedata.normalize("NFKC", text)
+    if drop_numbers:
+        text = _STANDALONE_NUMBER_RE.sub("", text.translate(_DASH_TABLE))
+    return " ".join(text.translate(_TITLE_CHAR_TABLE).split())
+
+
 def clean_title(text):
     if not text:
         return ""
-    text = unicodedata.normalize("NFKC", str(text))
-    dash_chars = ["-", "–", "—", "−", "‐", "-"]
-    for d in dash_chars:
-        text = text.replace(d, "")
-    cleaned = [
-        ch.lower()
-        for ch in text
-        if unicodedata.category(ch)[0] in ("L", "N", "Z")
-    ]
-    return re.sub(r"\s+", " ", "".join(cleaned)).strip()
+    return _clean_title_cached(str(text), False)
 
 def clean_title_for_remedial(text):
     if not text:
         return ""
-    text = unicodedata.normalize("NFKC", str(text))
-    dash_chars = ["-", "–", "—", "−", "‐", "-"]
-    for d in dash_chars:
-        text = text.replace(d, "")
-    text = re.sub(r"\b\d+\b", "", text)
-    cleaned = [
-        ch.lower()
-        for ch in text
-        if unicodedata.category(ch)[0] in ("L", "N", "Z")
-    ]
-    return re.sub(r"\s+", " ", "".join(cleaned)).strip()
\ No newline at end of file
+    return _clean_title_cached(str(text), True)
\ No newline at end of file
@@ -1,23 +1,26 @@
 # modules/url_verifier.py
 
 import re
-import requests
 from bs4 import BeautifulSoup
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz
 
 from .parsers import clean_title
-from .api_clients import _is_match
+from .api_clients import PROBE_SESSION, _is_match
 
 
 # =============================================================================
 # URL 類型判斷
 # =============================================================================
 
+_DOI_RE = re.compile(r'10\.\d{4,9}/')
+_AUTHOR_SEP_RE = re.compile(r'[;,]')
+_YEAR_RE = re.compile(r'\b(19|20)\d{2}\b')
+
 def classify_url_type(url: str) -> str:
     u = url.lower()
 
     # DOI
-    if "doi.org" in u or re.search(r'10\.\d{4,9}/', u):
+    if "doi.org" in u or _DOI_RE.search(u):
         return "doi"
 
     # 明確學術出版頁
@@ -53,7 +56,7 @@ def extract_author_surnames(author_str: str) -> set:
         return set()
 
     surnames = set()
-    for part in re.split(r'[;,]', author_str):
+    for part in _AUTHOR_SEP_RE.split(author_str):
         part = part.strip()
         if not part:
             continue
@@ -72,7 +75,7 @@ def extract_author_surnames(author_str: str) -> set:
 
 def fetch_page_semantic_meta(url: str, parsed_ref: dict) -> dict | None:
     try:
-        r = requests.get(url, timeout=8)
+        r = PROBE_SESSION.get(url, timeout=8)
         if r.status_code != 200:
             return None
 
@@ -129,7 +132,7 @@ def fetch_page_semantic_meta(url: str, parsed_ref: dict) -> dict | None:
 
         # ---------- Year ----------
         year = None
-        year_match = re.search(r'\b(19|20)\d{2}\b', text)
+        year_match = _YEAR_RE.search(text)
         if year_match:
             year = year_match.group(0)
 
@@ -167,11 +170,10 @@ def verify_academic_reference(parsed_ref: dict, meta: dict) -> bool:
             score += 1
 
     # 高度標題相似再加分
-    if SequenceMatcher(
-        None,
+    if fuzz.ratio(
         clean_title(parsed_ref.get("title")),
         clean_title(meta.get("title"))
-    ).ratio() >= 0.95:
+    ) >= 95:
         score += 1
 
     return score >= 2